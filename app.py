@@ -1,39 +1,187 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 
 import pandas as pd
 import numpy as np
-import sqlite3
-from flask import Flask, render_template, request, flash, redirect, url_for, session, send_file
+from flask import Flask, render_template, request, flash, redirect, url_for, session, jsonify, Response, g
+from flask import before_render_template, template_rendered
 import io
-import re
+import zlib
 import datetime
+import shutil
+import tempfile
+import time
 import psutil
 
+from data_processing.db import close_connection, configure as configure_database, get_connection
+from data_processing.jobs import JobRunner
+from data_processing.logs import LogFilter, follow as follow_log, read_lines
+from data_processing.matching import match_color_size
+from data_processing.metrics import Metrics
+from data_processing.pagination import paginate_datatables
+from data_processing.periods import period_labels, period_sql
+from data_processing.reorder import suggest_order_quantities
+from data_processing.report_cache import ReportCache
+from data_processing.snapshot import ReportSnapshot
+
 app = Flask(__name__)
 app.secret_key = 'secret_key_for_flash_messages'
 
 LOGFILE = "/tmp/mainAppLogs.txt"
-logging.basicConfig(filename=LOGFILE,
-                    filemode='a',
-                    format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-                    datefmt='%H:%M:%S',
-                    level=logging.DEBUG)
+# Records are handed to a queue and written by a background thread, so requests never wait for the disk.
+# The file rotates at LOG_MAX_MB, keeping LOG_BACKUP_COUNT old files.
+app.config['LOG_MAX_MB'] = int(os.environ.get('LOG_MAX_MB', '20'))
+app.config['LOG_BACKUP_COUNT'] = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+log_file_handler = logging.handlers.RotatingFileHandler(LOGFILE, maxBytes=app.config['LOG_MAX_MB'] * 2 ** 20,
+                                                        backupCount=app.config['LOG_BACKUP_COUNT'],
+                                                        encoding='utf-8')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s,%(msecs)03d %(name)s %(levelname)s %(message)s',
+                                                datefmt='%Y-%m-%d %H:%M:%S'))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+log_queue_handler = logging.handlers.QueueHandler(log_queue)
+# The queue handler merges the arguments (and any traceback) into the message, the file handler adds the rest
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(handlers=[log_queue_handler], level=logging.DEBUG)
+log_listener.start()
+# Flush the records still in the queue on exit
+atexit.register(log_listener.stop)
+# /logs?follow=1 streams for this many seconds, then the browser's EventSource reconnects where it stopped
+app.config['LOG_FOLLOW_SECONDS'] = int(os.environ.get('LOG_FOLLOW_SECONDS', '300'))
 
 LOGGER = logging.getLogger('mainApp')
 
 LOGGER.info("starting")
 
+# Reports read the SalesDaily rollup instead of the raw Sales line items. Set VERIFY_SALES_ROLLUP=1 to also
+# run every report against the raw Sales table and log any mismatch.
+app.config['USE_SALES_ROLLUP'] = os.environ.get('USE_SALES_ROLLUP', '1') == '1'
+app.config['VERIFY_SALES_ROLLUP'] = os.environ.get('VERIFY_SALES_ROLLUP', '0') == '1'
+
+# Finished reports are cached in-process, keyed by their parameters and the Timestamps table contents
+app.config['REPORT_CACHE_MAX_MB'] = int(os.environ.get('REPORT_CACHE_MAX_MB', '256'))
+report_cache = ReportCache(max_bytes=app.config['REPORT_CACHE_MAX_MB'] * 2 ** 20)
+
+# CSV exports are streamed in chunks of CSV_CHUNK_ROWS rows, gzip'ed when CSV_GZIP=1 and the client accepts it
+app.config['CSV_CHUNK_ROWS'] = int(os.environ.get('CSV_CHUNK_ROWS', '5000'))
+app.config['CSV_GZIP'] = os.environ.get('CSV_GZIP', '0') == '1'
+
+# Number of processes used to match SKU colors and sizes, and how many distinct SKU suffixes each task gets
+app.config['MATCHING_WORKERS'] = int(os.environ.get('MATCHING_WORKERS', '1'))
+app.config['MATCHING_CHUNK_SIZE'] = int(os.environ.get('MATCHING_CHUNK_SIZE', '10000'))
+
+# Uploaded CSVs are parsed and inserted IMPORT_CHUNK_ROWS rows at a time
+app.config['IMPORT_CHUNK_ROWS'] = int(os.environ.get('IMPORT_CHUNK_ROWS', '50000'))
+
+# Uploads and matching run as background jobs (set BACKGROUND_JOBS=0 to run them inside the request)
+app.config['BACKGROUND_JOBS'] = os.environ.get('BACKGROUND_JOBS', '1') == '1'
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', '2'))
+app.config['JOBS_DATABASE'] = os.environ.get('JOBS_DATABASE', 'jobs.db')
+# Job threads sit idle between jobs, so each closes its database connection and the page cache it holds when done
+job_runner = JobRunner(app.config['JOBS_DATABASE'], max_workers=app.config['JOB_WORKERS'],
+                       teardown=close_connection)
+
+# SQLite database and connection tuning, see data_processing/db.py. SQLite has a single writer, imports and
+# matching running side by side wait SQLITE_BUSY_TIMEOUT seconds for each other.
+app.config['DATABASE'] = os.environ.get('DATABASE', 'sales_management.db')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '600'))
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '65536'))
+app.config['SQLITE_MMAP_SIZE_MB'] = int(os.environ.get('SQLITE_MMAP_SIZE_MB', '256'))
+configure_database(database=app.config['DATABASE'], busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+                   cache_size_kb=app.config['SQLITE_CACHE_SIZE_KB'],
+                   mmap_size=app.config['SQLITE_MMAP_SIZE_MB'] * 2 ** 20)
+
+# Optional columnar snapshot of the joined sales fact table (needs pyarrow), rebuilt after every load of a table
+# it is made from. Reports are computed from it instead of SQLite whenever it is up to date.
+app.config['REPORT_SNAPSHOT'] = os.environ.get('REPORT_SNAPSHOT', '0') == '1'
+app.config['REPORT_SNAPSHOT_DIR'] = os.environ.get('REPORT_SNAPSHOT_DIR', 'report_snapshot')
+if app.config['REPORT_SNAPSHOT'] and not ReportSnapshot.available:
+    LOGGER.warning("REPORT_SNAPSHOT=1 but pyarrow is not installed, reports are built in SQLite")
+    app.config['REPORT_SNAPSHOT'] = False
+report_snapshot = ReportSnapshot(app.config['REPORT_SNAPSHOT_DIR'])
+
+# Request and stage timings are published on /metrics. Report queries slower than SLOW_QUERY_SECONDS are logged
+# with their SQL and parameters (0 turns the slow-query log off).
+app.config['SLOW_QUERY_SECONDS'] = float(os.environ.get('SLOW_QUERY_SECONDS', '0'))
+metrics = Metrics()
+metrics.histogram('http_request_duration_seconds', "Time spent handling requests, up to the start of the response body")
+metrics.counter('http_requests_total', "Requests handled")
+metrics.gauge('http_request_rss_delta_bytes', "Change of the process RSS during the last request to each endpoint")
+metrics.counter('slow_queries_total', "SQL queries slower than SLOW_QUERY_SECONDS")
+metrics.counter('import_rows_total', "Rows read from uploaded files")
+SLOW_QUERY_LOGGER = logging.getLogger('mainApp.slow_query')
+
+# The order sheet is pre-filled with enough stock for ORDER_COVER_DAYS days at the sales velocity of the report
+# range, rounded up to packs of ORDER_PACK_SIZE. Both can be changed on the report page.
+app.config['ORDER_COVER_DAYS'] = int(os.environ.get('ORDER_COVER_DAYS', '30'))
+app.config['ORDER_PACK_SIZE'] = int(os.environ.get('ORDER_PACK_SIZE', '1'))
+
+# Largest number of period columns /period_report builds, a daily bucket over several years would be rejected
+app.config['MAX_REPORT_PERIODS'] = int(os.environ.get('MAX_REPORT_PERIODS', '400'))
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.request_start_ram = ram()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (CSV downloads) are timed until their body starts, the rest is spent in the WSGI server
+    if 'request_start' in g:
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_start,
+                        endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        metrics.set('http_request_rss_delta_bytes', int((ram() - g.request_start_ram) * 2 ** 20), endpoint=endpoint)
+    return response
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    if 'template_start' in g:
+        metrics.record_stage('render', time.perf_counter() - g.template_start, template=template.name)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/logs', methods=['GET'])
 def get_logs(*args, **kwargs):
+    # Filters: level (minimum level), since and until (ISO date and time). With follow=1 new lines are streamed
+    # as server-sent events. Otherwise the last 50 KB are returned, or the lines written after cursor; the
+    # cursor to poll with next is sent in the X-Log-Cursor header.
     max_print_size = 50_000
-    filesize = os.stat(LOGFILE).st_size
-    with open(LOGFILE, "r") as f:
-        if filesize > max_print_size:
-            f.seek(filesize - max_print_size)
-        text = f.read()
-    return "<br>".join(text.splitlines())
+    try:
+        log_filter = LogFilter(min_level=request.args.get('level'),
+                               since=parse_log_time(request.args.get('since')),
+                               until=parse_log_time(request.args.get('until')))
+    except ValueError as e:
+        return str(e), 400
+    cursor = request.args.get('cursor') or request.headers.get('Last-Event-ID')
+
+    if request.args.get('follow') == '1':
+        stream = follow_log(LOGFILE, cursor, log_filter, duration=app.config['LOG_FOLLOW_SECONDS'])
+        return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    lines, next_cursor = read_lines(LOGFILE, cursor, tail_bytes=max_print_size,
+                                    max_bytes=max_print_size if cursor is None else 2 ** 20)
+    return Response("<br>".join(log_filter.apply(lines)), headers={'X-Log-Cursor': next_cursor})
+
+
+def parse_log_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
 
 
 def generate_report_data(start_date, end_date, importer=None):
@@ -42,13 +190,145 @@ def generate_report_data(start_date, end_date, importer=None):
     end_date_sql = pd.to_datetime(end_date).strftime('%Y-%m-%d')
 
     # Connect to SQLite database
-    conn = sqlite3.connect('sales_management.db')
+    conn = get_connection()
+
+    sales_table = 'SalesDaily' if app.config['USE_SALES_ROLLUP'] else 'Sales'
+
+    # Any upload changes the Timestamps table, so stale cache entries are never hit again
+    with metrics.stage('report.cache_lookup'):
+        cache_key = (start_date_sql, end_date_sql, importer, sales_table, get_load_version(conn))
+        final_report = report_cache.get(cache_key)
+    if final_report is not None:
+        LOGGER.debug(f"report cache hit for {cache_key[:3]}")
+        return final_report
+
+    final_report = None
+    if app.config['REPORT_SNAPSHOT']:
+        final_report = build_report_from_snapshot(sales_table, start_date_sql, end_date_sql, importer)
+    if final_report is None:
+        final_report = build_report(conn, sales_table, start_date_sql, end_date_sql, importer)
+
+    # Optionally cross-check the rollup against the raw Sales line items
+    if sales_table == 'SalesDaily' and app.config['VERIFY_SALES_ROLLUP']:
+        raw_report = build_report(conn, 'Sales', start_date_sql, end_date_sql, importer)
+        if not raw_report.reset_index(drop=True).equals(final_report.reset_index(drop=True)):
+            LOGGER.error(f"SalesDaily rollup report differs from raw Sales report for "
+                         f"{start_date_sql}..{end_date_sql}, importer={importer}: "
+                         f"{len(final_report)} rows vs {len(raw_report)} rows")
+        else:
+            LOGGER.debug(f"SalesDaily rollup report matches raw Sales report ({len(final_report)} rows)")
+
+    report_cache.put(cache_key, final_report)
+    return final_report
+
+
+def generate_period_report(start_date, end_date, importer, period):
+    # The report with one sold quantity column per period of [start_date, end_date] (labelled as returned by
+    # period_labels) after the totals, built from a single scan of the sales table. Raises ValueError for
+    # unknown period specs or too many periods.
+    start_date_sql = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+    end_date_sql = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+    labels = period_labels(period, start_date_sql, end_date_sql)
+    if len(labels) > app.config['MAX_REPORT_PERIODS']:
+        raise ValueError(f"{len(labels)} periods requested, at most {app.config['MAX_REPORT_PERIODS']} are allowed")
+
+    conn = get_connection()
+    sales_table = 'SalesDaily' if app.config['USE_SALES_ROLLUP'] else 'Sales'
+
+    with metrics.stage('report.cache_lookup'):
+        cache_key = ('periods', period.strip().lower(), start_date_sql, end_date_sql, importer, sales_table,
+                     get_load_version(conn))
+        final_report = report_cache.get(cache_key)
+    if final_report is not None:
+        LOGGER.debug(f"period report cache hit for {cache_key[:5]}")
+        return final_report
+
+    final_report = build_period_report(conn, sales_table, start_date_sql, end_date_sql, importer, period, labels)
+    report_cache.put(cache_key, final_report)
+    return final_report
+
+
+def get_load_version(conn):
+    # Snapshot of every table's last load time, used to invalidate cached reports
+    return tuple(conn.execute("SELECT table_name, last_loaded FROM Timestamps ORDER BY table_name").fetchall())
+
+
+def build_report(conn, sales_table, start_date_sql, end_date_sql, importer):
+    query, params = report_query(sales_table, start_date_sql, end_date_sql, importer,
+                                 by_sale_date=scan_by_sale_date(conn, sales_table, start_date_sql, end_date_sql))
+
+    # Fetch the data
+    sales_report = read_sql(query, conn, params, stage='report.sql')
+
+    print(f"Generated query with importer {importer}: {query}")
+    with metrics.stage('report.pandas'):
+        return finish_report(sales_report)
+
+
+def build_period_report(conn, sales_table, start_date_sql, end_date_sql, importer, period, labels):
+    # Same join as build_report, grouped by period as well, so N periods cost one scan instead of N reports
+    query, params = report_query(sales_table, start_date_sql, end_date_sql, importer, period=period,
+                                 by_sale_date=scan_by_sale_date(conn, sales_table, start_date_sql, end_date_sql))
+    period_rows = read_sql(query, conn, params, stage='report.sql')
+
+    with metrics.stage('report.pandas'):
+        quantity_has_null = period_rows.pop('quantity_has_null').astype(bool).any()
+        if quantity_has_null:
+            period_rows['quantity'] = period_rows['quantity'].astype(float)
+
+        # Attributes are filled with zeros as in finish_report, pivot_table would drop rows with NULL keys
+        key_columns = [column for column in period_rows.columns if column not in ('period', 'quantity')]
+        period_rows[key_columns] = period_rows[key_columns].fillna(0)
+        period_rows['quantity'] = period_rows['quantity'].fillna(0)
+
+        # One column per period, periods without sales are kept as zeros
+        sales_report = period_rows.groupby(key_columns + ['period'])['quantity'].sum().unstack('period')
+        sales_report = sales_report.reindex(columns=labels).fillna(0).astype(period_rows['quantity'].dtype)
+        sales_report.columns.name = None
+        sales_report = sales_report.reset_index()
+        sales_report['quantity'] = sales_report[labels].sum(axis=1)
+        sales_report['quantity_has_null'] = quantity_has_null
+        return finish_report(sales_report, period_columns=labels)
+
+
+def scan_by_sale_date(conn, sales_table, start_date_sql, end_date_sql):
+    # Whether the report query should find its rows through the sale_date index. Grouped by S.sku first, SQLite
+    # prefers walking the sku index over the whole table, which saves the sort of the GROUP BY but reads every
+    # row. That only pays off when the range covers a large part of the table (about a quarter of its days).
+    # Separate subqueries, SQLite only answers a lone MIN() or MAX() from the index
+    first_day, last_day = conn.execute(f"SELECT (SELECT MIN(sale_date) FROM {sales_table}), "
+                                       f"(SELECT MAX(sale_date) FROM {sales_table})").fetchone()
+    if first_day is None:
+        return True
+    table_days = (pd.Timestamp(last_day) - pd.Timestamp(first_day)).days + 1
+    range_days = (min(pd.Timestamp(end_date_sql), pd.Timestamp(last_day)) -
+                  max(pd.Timestamp(start_date_sql), pd.Timestamp(first_day))).days + 1
+    return range_days < table_days / 4
+
+
+def report_query(sales_table, start_date_sql, end_date_sql, importer, period=None, by_sale_date=False):
+    # sales_table is either the raw Sales line items or the SalesDaily rollup, both have sku, quantity and sale_date.
+    # The GROUP BY runs in SQLite so only one row per child SKU (and product attributes) reaches pandas.
+    # With a period spec (see data_processing/periods.py) there is one row per child SKU and period instead.
+    # by_sale_date keeps the sku index out of the plan (a unary + is not indexable), so the sale_date range drives it.
+    grouping_columns_sql = [
+        'S.sku', 'P.item_type', 'P.sku', 'B.manufacturer_sku', 'P.product_name', 'V.color',
+        'V.size', 'P.main_category', 'P.importer', 'P.manufacturer', 'P.purchase_price', 'P.consumer_price'
+    ]
+    if by_sale_date:
+        grouping_columns_sql[0] = '+S.sku'
+    params = []
+    period_column = ''
+    if period is not None:
+        period_expression, params = period_sql(period, start_date_sql)
+        period_column = f"{period_expression} as period,"
+        grouping_columns_sql.append('period')
 
-    # Query to fetch the data
     query = f'''
-    SELECT
-        S.quantity,
-        s.sku as child_sku,
+    SELECT {period_column}
+        SUM(S.quantity) as quantity,
+        MAX(S.quantity IS NULL) as quantity_has_null,
+        S.sku as child_sku,
         P.item_type,
         P.sku as master_sku,
         P.product_name,
@@ -59,32 +339,57 @@ def generate_report_data(start_date, end_date, importer=None):
         P.main_category,
         V.color,
         V.size,
-        I.quantity as bin_quantity,
+        MIN(I.quantity) as bin_quantity,
         B.manufacturer_sku
     FROM
-        Sales S
+        {sales_table} S
         LEFT JOIN Variations V on S.sku = V.sku
         LEFT JOIN Products P on V.parent_sku = P.sku
         LEFT JOIN Inventory I on S.sku = I.sku
         LEFT JOIN BarcodesForVariations B on S.sku = B.sku
     WHERE
-        date(substr(S.issue_date,7,4)||'-'||substr(S.issue_date,4,2)||'-'||substr(S.issue_date,1,2)) BETWEEN date('{start_date_sql}') AND date('{end_date_sql}')
+        S.sale_date BETWEEN ? AND ?
 '''
 
     # Adding condition for importer if it's not 'All'
+    params += [start_date_sql, end_date_sql]
     if importer != "All":
-        query += f" AND P.importer = '{importer}' "
+        query += " AND P.importer = ? "
+        params.append(importer)
 
-    query += '''
-        ORDER BY
-            S.quantity DESC
+    query += f'''
+        GROUP BY
+            {', '.join(grouping_columns_sql)}
     '''
+    return query, params
+
+
+def build_report_from_snapshot(sales_table, start_date_sql, end_date_sql, importer):
+    # Same per-SKU rows as the GROUP BY in build_report, aggregated from the columnar snapshot.
+    # Returns None when the snapshot is missing or older than the last load of one of its tables.
+    with metrics.stage('report.snapshot_scan'):
+        sales_report = report_snapshot.aggregate(
+            report_snapshot_version(sales_table), start_date_sql, end_date_sql, importer,
+            keys=['child_sku', 'item_type', 'master_sku', 'product_name', 'importer', 'manufacturer',
+                  'purchase_price', 'consumer_price', 'main_category', 'color', 'size', 'manufacturer_sku'],
+            aggregations=[('quantity', 'quantity', 'sum'), ('quantity_has_null', 'quantity', 'has_null'),
+                          ('bin_quantity', 'bin_quantity', 'min')]
+        )
+    if sales_report is None:
+        LOGGER.debug("report snapshot is not up to date, building the report in SQLite")
+        return None
+    with metrics.stage('report.pandas'):
+        return finish_report(sales_report)
 
-    # Fetch the data
-    sales_report = pd.read_sql_query(query, conn)
 
-    # Close the connection
-    conn.close()
+def finish_report(sales_report, period_columns=()):
+    # Turns the per-SKU rows of build_report or build_report_from_snapshot into the final report layout.
+    # period_columns are the per-period quantities of build_period_report, they are summed like quantity.
+
+    # A NULL quantity on any sales line turns the quantities into floats, as they were when summed in pandas
+    if sales_report.pop('quantity_has_null').astype(bool).any():
+        sales_report['quantity'] = sales_report['quantity'].astype(float)
+
     # Fill NaN values with zeros
     sales_report = sales_report.fillna(0)
 
@@ -94,18 +399,23 @@ def generate_report_data(start_date, end_date, importer=None):
         'size', 'main_category', 'importer', 'manufacturer', 'purchase_price', 'consumer_price'
     ]
 
-    # Single Aggregation
+    # SQL keeps NULL and 0 apart while they are the same group once filled with zeros, merge those groups.
+    # This runs on one row per SKU, not per sales line.
     final_report = sales_report.groupby(grouping_columns, as_index=False).agg(
         {'quantity': 'sum', 'bin_quantity': 'first'}
     )
+    if period_columns:
+        # One sum over all period columns, agg would run them one column at a time. Both groupbys sort by the same keys.
+        period_sums = sales_report.groupby(grouping_columns)[list(period_columns)].sum().reset_index(drop=True)
+        final_report = pd.concat([final_report, period_sums], axis=1)
 
     # Reorder the columns
     final_report = final_report[
         ['child_sku', 'master_sku', 'manufacturer_sku', 'product_name', 'color', 'size', 
-        'main_category', 'importer', 'manufacturer', 'quantity', 'bin_quantity']
+        'main_category', 'importer', 'manufacturer', 'quantity', 'bin_quantity', *period_columns]
     ]
 
-    # Sort by quantity (big to small), bin_quantity (big to small), product_name (alphabetical order), and importer (alphabetical order)
+    # Sort by manufacturer, product_name, color and size (alphabetical order)
     final_report = final_report.sort_values(
         by=['manufacturer', 'product_name', 'color', 'size'],
         ascending=[True, True, True, True]
@@ -125,74 +435,449 @@ def generate_report_data(start_date, end_date, importer=None):
         final_report['manufacturer_sku']
     )
 
-    ## Get the list of unique importers
-    unique_importers = ['All'] + final_report['importer'].unique().tolist()
-    print(f"Generated query with importer {importer}: {query}")
+    # Repetitive text columns are kept as categoricals, which makes cached reports much smaller
+    for column in ['color', 'size', 'main_category', 'importer', 'manufacturer']:
+        final_report[column] = final_report[column].astype('category')
+
     return final_report
 
 def get_all_unique_importers():
     # Fetch all unique importers from your database
-    conn = sqlite3.connect('sales_management.db')
+    conn = get_connection()
     unique_importers_query = "SELECT DISTINCT importer FROM Products"
     unique_importers = pd.read_sql_query(unique_importers_query, conn)['importer'].tolist()
-    conn.close()
     return unique_importers
 
 
-def import_csv_to_db(file_content, table_name, columns_to_keep, columns_to_rename, skiprows=1):
-    file_like_object = io.StringIO(file_content)
-    LOGGER.debug(f"read {len(file_content)} bytes as csv")
-    df = pd.read_csv(file_like_object, skiprows=skiprows)
-    print("CSV columns:", df.columns)
-    missing_columns = [col for col in columns_to_keep if col not in df.columns]
-    
-    if missing_columns:
-        LOGGER.error(f"missing columns {missing_columns}")
-        raise ValueError(f"Missing columns in CSV: {', '.join(missing_columns)}")
-
-    df = df[columns_to_keep]
-    df.rename(columns=columns_to_rename, inplace=True)
-    
-    # Removing duplicates for BarcodesForVariations
-    if table_name == "BarcodesForVariations":
-        df.drop_duplicates(inplace=True)
-    
-    conn = sqlite3.connect('sales_management.db')
-    LOGGER.error(f"inserting table of shape {df.shape} to DB into table {table_name}")
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-    conn.close()
-
-def update_last_loaded_timestamp(table):
-    conn = sqlite3.connect('sales_management.db')
+# Indexes created every time a table is (re)loaded. Sales is range-scanned on sale_date,
+# everything else is joined on sku / parent_sku by generate_report_data.
+TABLE_INDEXES = {
+    'Sales': [['sale_date'], ['sku'], ['document_type', 'document_number', 'sku']],
+    'SalesDaily': [['sale_date', 'sku', 'quantity'], ['sku']],
+    'Products': [['sku']],
+    'Inventory': [['sku']],
+    'BarcodesForVariations': [['sku']],
+    'Variations': [['sku'], ['parent_sku']],
+}
+
+
+def create_table_indexes(conn, table_name, index_table=None):
+    # index_table is the table the indexes are built on when it is a shadow copy of table_name.
+    # Index names stay unique across swaps: a shadow gets idx_<table>_<columns>_2 while the live table
+    # still owns idx_<table>_<columns>, and the other way around on the next load.
+    index_table = index_table or table_name
+    existing_indexes = {
+        tuple(info[2] for info in conn.execute(f"PRAGMA index_info({index[1]})"))
+        for index in conn.execute(f"PRAGMA index_list({index_table})")
+    }
+    for columns in TABLE_INDEXES.get(table_name, []):
+        if tuple(columns) in existing_indexes:
+            continue
+        base_name = index_name = f"idx_{table_name}_{'_'.join(columns)}"
+        suffix = 1
+        while conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)).fetchone():
+            suffix += 1
+            index_name = f"{base_name}_{suffix}"
+        conn.execute(f"CREATE INDEX {index_name} ON {index_table} ({', '.join(columns)})")
+    conn.commit()
+
+
+def shadow_table_name(table_name):
+    return f"{table_name}__shadow"
+
+
+def swap_in_tables(conn, table_names):
+    # Replace each live table by its fully built and indexed shadow copy in one short transaction.
+    # With WAL, readers keep using the previous version until the commit and never see a missing or
+    # half-filled table.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table_name in table_names:
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            conn.execute(f"ALTER TABLE {shadow_table_name(table_name)} RENAME TO {table_name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    LOGGER.info(f"swapped in new versions of {', '.join(table_names)}")
+
+
+def parse_issue_date(issue_date):
+    # issue_date is exported as DD/MM/YYYY (optionally followed by a time), store it as ISO YYYY-MM-DD
+    return pd.to_datetime(issue_date.astype(str).str.slice(0, 10), format='%d/%m/%Y',
+                          errors='coerce').dt.strftime('%Y-%m-%d')
+
+
+def sales_rollup_select(sales_table):
+    return f"SELECT sku, sale_date, SUM(quantity) AS quantity FROM {sales_table} WHERE sale_date IS NOT NULL"
+
+
+def build_sales_rollup(conn, sales_table):
+    # Build the complete rollup of sales_table into the SalesDaily shadow table, ready to be swapped in
+    rollup_table = shadow_table_name('SalesDaily')
+    conn.execute(f"DROP TABLE IF EXISTS {rollup_table}")
+    conn.execute(f"CREATE TABLE {rollup_table} AS {sales_rollup_select(sales_table)} GROUP BY sku, sale_date")
+    create_table_indexes(conn, 'SalesDaily', rollup_table)
+
+
+def refresh_sales_rollup(conn, sale_dates=None):
+    # SalesDaily holds the quantity summed per (sku, sale_date). Passing sale_dates only rebuilds those days
+    # in place, inside the caller's transaction which commits them together with the Sales rows they come from.
+    # Otherwise the whole rollup is rebuilt from Sales and swapped in.
+    if sale_dates is None:
+        build_sales_rollup(conn, 'Sales')
+        swap_in_tables(conn, ['SalesDaily'])
+        return
+    sale_dates = sorted(set(sale_dates))
+    for i in range(0, len(sale_dates), 500):
+        batch = sale_dates[i:i + 500]
+        placeholders = ', '.join('?' * len(batch))
+        conn.execute(f"DELETE FROM SalesDaily WHERE sale_date IN ({placeholders})", batch)
+        conn.execute(f"INSERT INTO SalesDaily {sales_rollup_select('Sales')} AND sale_date IN ({placeholders}) "
+                     f"GROUP BY sku, sale_date", batch)
+
+
+# Tables joined into the report snapshot, by their alias in the report query. S is the sales table.
+SNAPSHOT_JOINS = {'V': 'Variations', 'P': 'Products', 'I': 'Inventory', 'B': 'BarcodesForVariations'}
+
+# Columns of the report snapshot: (column, table alias, source column)
+SNAPSHOT_COLUMNS = [
+    ('sale_date', 'S', 'sale_date'),
+    ('quantity', 'S', 'quantity'),
+    ('child_sku', 'S', 'sku'),
+    ('item_type', 'P', 'item_type'),
+    ('master_sku', 'P', 'sku'),
+    ('product_name', 'P', 'product_name'),
+    ('importer', 'P', 'importer'),
+    ('manufacturer', 'P', 'manufacturer'),
+    ('purchase_price', 'P', 'purchase_price'),
+    ('consumer_price', 'P', 'consumer_price'),
+    ('main_category', 'P', 'main_category'),
+    ('color', 'V', 'color'),
+    ('size', 'V', 'size'),
+    ('bin_quantity', 'I', 'quantity'),
+    ('manufacturer_sku', 'B', 'manufacturer_sku'),
+]
+
+# Loading any of these tables makes the report snapshot stale
+SNAPSHOT_TABLES = ['Sales'] + list(SNAPSHOT_JOINS.values())
+
+
+def report_snapshot_version(sales_table):
+    return {'sales_table': sales_table, 'last_loaded': get_last_loaded_timestamps(SNAPSHOT_TABLES)}
+
+
+def refresh_report_snapshot():
+    # Rebuild the columnar snapshot one month of sales at a time
+    conn = get_connection()
+    sales_table = 'SalesDaily' if app.config['USE_SALES_ROLLUP'] else 'Sales'
+    report_snapshot.invalidate()
+
+    tables = {'S': sales_table, **SNAPSHOT_JOINS}
+    existing_tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    missing_tables = [table_name for table_name in tables.values() if table_name not in existing_tables]
+    if missing_tables:
+        LOGGER.info(f"not building the report snapshot, {', '.join(missing_tables)} not loaded yet")
+        return
+
+    # SQLite columns can hold values of any type, look at what is actually stored
+    columns = []
+    for column, alias, source_column in SNAPSHOT_COLUMNS:
+        storage_classes = conn.execute(f"SELECT DISTINCT typeof({source_column}) FROM {tables[alias]}").fetchall()
+        columns.append((column, [row[0] for row in storage_classes]))
+    query = f'''
+    SELECT
+        {', '.join(f"{alias}.{source_column} as {column}" for column, alias, source_column in SNAPSHOT_COLUMNS)}
+    FROM
+        {sales_table} S
+        LEFT JOIN Variations V on S.sku = V.sku
+        LEFT JOIN Products P on V.parent_sku = P.sku
+        LEFT JOIN Inventory I on S.sku = I.sku
+        LEFT JOIN BarcodesForVariations B on S.sku = B.sku
+    WHERE
+        S.sale_date BETWEEN ? AND ?
+    '''
+    months = [row[0] for row in conn.execute(f"SELECT DISTINCT substr(sale_date, 1, 7) FROM {sales_table} "
+                                             f"WHERE sale_date IS NOT NULL ORDER BY 1")]
+    partitions = ((month, conn.execute(query, (f"{month}-01", f"{month}-31")).fetchall()) for month in months)
+
+    start_ram = ram()
+    try:
+        with metrics.stage('snapshot.build'):
+            rows_written = report_snapshot.build(partitions, columns, report_snapshot_version(sales_table))
+    except Exception:
+        LOGGER.exception("building the report snapshot failed, reports are built in SQLite")
+        return
+    LOGGER.info(f"report snapshot rebuilt from {sales_table}: {rows_written} rows in {len(months)} months, "
+                f"ram {start_ram:.0f} -> {ram():.0f} MB")
+
+
+def upgrade_database():
+    # Bring databases created by older versions up to date: Timestamps row counters, Sales.sale_date and indexes
+    conn = get_connection()
+    conn.execute("CREATE TABLE IF NOT EXISTS Timestamps (table_name TEXT, last_loaded TEXT)")
+    timestamps_columns = [row[1] for row in conn.execute("PRAGMA table_info(Timestamps)")]
+    for counter_column in ['rows_inserted', 'rows_updated']:
+        if counter_column not in timestamps_columns:
+            conn.execute(f"ALTER TABLE Timestamps ADD COLUMN {counter_column} INTEGER")
+    conn.commit()
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'Sales' in tables:
+        sales_columns = [row[1] for row in conn.execute("PRAGMA table_info(Sales)")]
+        if 'sale_date' not in sales_columns:
+            LOGGER.info("adding sale_date column to Sales")
+            conn.execute("ALTER TABLE Sales ADD COLUMN sale_date TEXT")
+            conn.execute("UPDATE Sales SET sale_date = "
+                         "date(substr(issue_date,7,4)||'-'||substr(issue_date,4,2)||'-'||substr(issue_date,1,2))")
+            conn.commit()
+        if 'SalesDaily' not in tables:
+            LOGGER.info("building SalesDaily rollup")
+            refresh_sales_rollup(conn)
+            tables.add('SalesDaily')
+    for table_name in TABLE_INDEXES:
+        if table_name in tables:
+            create_table_indexes(conn, table_name)
+
+    sales_table = 'SalesDaily' if app.config['USE_SALES_ROLLUP'] else 'Sales'
+    if app.config['REPORT_SNAPSHOT'] and not report_snapshot.is_current(report_snapshot_version(sales_table)):
+        refresh_report_snapshot()
+
+
+def import_csv_to_db(file_stream, table_name, columns_to_keep, columns_to_rename, skiprows=1, key_columns=None,
+                     progress=None, dtype=None):
+    # file_stream is the binary upload stream (CSV text is accepted as well). It is parsed in chunks of
+    # IMPORT_CHUNK_ROWS rows and every chunk is written straight into SQLite inside a single transaction,
+    # so memory use stays flat no matter how big the export is.
+    # Without key_columns the file is loaded into a shadow table that replaces the live one atomically once it
+    # is complete and indexed. With key_columns it is loaded into a staging table and merged into the existing
+    # one by upsert_from_staging. Returns the number of rows inserted and updated.
+    # dtype fixes the pandas type of CSV columns, otherwise every chunk infers its own and the first chunk decides
+    # the column types of the table.
+    if isinstance(file_stream, str):
+        text_stream = io.StringIO(file_stream)
+    else:
+        text_stream = io.TextIOWrapper(file_stream, encoding='utf-8', newline='')
+
+    load_table = shadow_table_name(table_name) if key_columns is None else f"{table_name}_staging"
+    start_ram = peak_ram = ram()
+    conn = get_connection()
+    try:
+        reader = pd.read_csv(text_stream, skiprows=skiprows, dtype=dtype, chunksize=app.config['IMPORT_CHUNK_ROWS'])
+        rows_imported = 0
+        # Parsing happens while the reader yields the next chunk, time it separately from the inserts
+        parse_seconds = insert_seconds = 0
+        parse_start = time.perf_counter()
+        for chunk_number, df in enumerate(reader):
+            parse_seconds += time.perf_counter() - parse_start
+            if chunk_number == 0:
+                # The header comes with the first chunk, validate it before touching the database
+                print("CSV columns:", df.columns)
+                missing_columns = [col for col in columns_to_keep if col not in df.columns]
+
+                if missing_columns:
+                    LOGGER.error(f"missing columns {missing_columns}")
+                    raise ValueError(f"Missing columns in CSV: {', '.join(missing_columns)}")
+
+            df = df[columns_to_keep]
+            df = df.rename(columns=columns_to_rename)
+
+            # Removing duplicates for BarcodesForVariations (across chunks once everything is loaded)
+            if table_name == "BarcodesForVariations":
+                df = df.drop_duplicates()
+
+            # Materialize the issue date in ISO format so reports can filter on an indexed column
+            if table_name == "Sales":
+                df['sale_date'] = parse_issue_date(df['issue_date'])
+
+            if chunk_number == 0:
+                # Take the write lock up front, a deferred transaction could deadlock with a concurrent import
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"DROP TABLE IF EXISTS {load_table}")
+                conn.execute(pd.io.sql.get_schema(df, load_table))
+            insert_start = time.perf_counter()
+            insert_rows(conn, load_table, df)
+            insert_seconds += time.perf_counter() - insert_start
+
+            rows_imported += len(df)
+            peak_ram = max(peak_ram, ram())
+            if progress is not None:
+                progress(rows_imported)
+            LOGGER.debug(f"inserted chunk {chunk_number} ({len(df)} rows) into {table_name}")
+            parse_start = time.perf_counter()
+        metrics.record_stage('import.parse', parse_seconds, table=table_name)
+        metrics.record_stage('import.insert', insert_seconds, int((peak_ram - start_ram) * 2 ** 20), table=table_name)
+        metrics.inc('import_rows_total', rows_imported, table=table_name)
+
+        if table_name == "BarcodesForVariations":
+            conn.execute(f"DELETE FROM {load_table} WHERE rowid NOT IN "
+                         f"(SELECT MIN(rowid) FROM {load_table} GROUP BY {', '.join(columns_to_rename.values())})")
+
+        changed_sale_dates = None
+        if key_columns is None:
+            rows_inserted, rows_updated = rows_imported, 0
+        else:
+            with metrics.stage('import.upsert', table=table_name):
+                rows_inserted, rows_updated, changed_sale_dates = upsert_from_staging(conn, table_name, load_table,
+                                                                                      key_columns)
+            # SalesDaily is brought up to date in the same transaction, reports never see it behind Sales
+            if table_name == "Sales":
+                with metrics.stage('import.rollup', table=table_name):
+                    if changed_sale_dates is None:
+                        # Sales was created by this upload, roll all of it up
+                        conn.execute("DROP TABLE IF EXISTS SalesDaily")
+                        conn.execute(f"CREATE TABLE SalesDaily AS {sales_rollup_select('Sales')} "
+                                     f"GROUP BY sku, sale_date")
+                    else:
+                        refresh_sales_rollup(conn, changed_sale_dates)
+        with metrics.stage('import.commit', table=table_name):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if not isinstance(text_stream, io.StringIO):
+            # Leave the upload stream open for its owner
+            text_stream.detach()
+
+    LOGGER.info(f"imported {rows_imported} rows into {table_name} ({rows_inserted} inserted, {rows_updated} updated), "
+                f"peak RSS {peak_ram:.0f} MB ({peak_ram - start_ram:+.0f} MB)")
+    if key_columns is None:
+        # Index the new version (and roll up new Sales) before it goes live, then swap it in
+        with metrics.stage('import.index', table=table_name):
+            create_table_indexes(conn, table_name, load_table)
+        swapped_tables = [table_name]
+        if table_name == "Sales":
+            with metrics.stage('import.rollup', table=table_name):
+                build_sales_rollup(conn, load_table)
+            swapped_tables.append('SalesDaily')
+        with metrics.stage('import.swap', table=table_name):
+            swap_in_tables(conn, swapped_tables)
+    else:
+        # Only missing when the upload created the table
+        with metrics.stage('import.index', table=table_name):
+            create_table_indexes(conn, table_name)
+            if table_name == "Sales":
+                create_table_indexes(conn, 'SalesDaily')
+    return rows_inserted, rows_updated
+
+
+def upsert_from_staging(conn, table_name, staging_table, key_columns):
+    # Merge staging_table into table_name. Every key whose staged rows differ from its rows in table_name (counting
+    # repeated lines) has its existing rows replaced by the staged ones, keys that are unchanged are not touched.
+    # Runs inside the caller's transaction and drops staging_table when done.
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({staging_table})")]
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+
+    table_exists = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                (table_name,)).fetchone()[0]
+    if not table_exists:
+        conn.execute(f"ALTER TABLE {staging_table} RENAME TO {table_name}")
+        rows_inserted = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        return rows_inserted, 0, None
+
+    # The lookups below go through the TABLE_INDEXES index on the key columns of table_name
+    row_match = ' AND '.join(f"T.{column} IS S.{column}" for column in columns)
+    key_match = ' AND '.join(f"T.{column} IS K.{column}" for column in key_columns)
+    staged_key_match = ' AND '.join(f"S.{column} IS K.{column}" for column in key_columns)
+
+    # A key is changed when one of its distinct staged rows occurs a different number of times in table_name,
+    # or when table_name has a different number of rows for it (rows that are missing from the upload)
+    conn.execute("DROP TABLE IF EXISTS temp.staged_rows")
+    conn.execute("DROP TABLE IF EXISTS temp.changed_keys")
+    conn.execute(f"CREATE TEMP TABLE staged_rows AS SELECT {column_list}, COUNT(*) AS staged_count "
+                 f"FROM {staging_table} GROUP BY {column_list}")
+    conn.execute(f"""
+        CREATE TEMP TABLE changed_keys AS
+        SELECT {', '.join('K.' + column for column in key_columns)},
+            EXISTS (SELECT 1 FROM {table_name} T WHERE {key_match}) AS existed
+        FROM (
+            SELECT {key_list} FROM temp.staged_rows S
+            WHERE S.staged_count != (SELECT COUNT(*) FROM {table_name} T WHERE {row_match})
+                UNION
+            SELECT {key_list} FROM (SELECT {key_list}, SUM(staged_count) AS staged_count
+                                    FROM temp.staged_rows GROUP BY {key_list}) K
+            WHERE K.staged_count != (SELECT COUNT(*) FROM {table_name} T WHERE {key_match})
+        ) K
+    """)
+    conn.execute("DROP TABLE temp.staged_rows")
+
+    rows_inserted, rows_updated = conn.execute(f"""
+        SELECT COALESCE(SUM(K.existed = 0), 0), COALESCE(SUM(K.existed = 1), 0)
+        FROM temp.changed_keys K JOIN {staging_table} S ON {staged_key_match}
+    """).fetchone()
+
+    # Sale dates of both the replaced and the new rows, so the daily rollup can be refreshed for just those days
+    changed_sale_dates = None
+    if 'sale_date' in columns:
+        changed_sale_dates = [row[0] for row in conn.execute(f"""
+            SELECT T.sale_date FROM temp.changed_keys K JOIN {table_name} T ON {key_match}
+            UNION
+            SELECT S.sale_date FROM temp.changed_keys K JOIN {staging_table} S ON {staged_key_match}
+        """) if row[0] is not None]
+
+    conn.execute(f"""
+        DELETE FROM {table_name} WHERE rowid IN
+        (SELECT T.rowid FROM temp.changed_keys K JOIN {table_name} T ON {key_match} WHERE K.existed = 1)
+    """)
+    conn.execute(f"""
+        INSERT INTO {table_name} ({column_list})
+        SELECT {', '.join('S.' + column for column in columns)}
+        FROM temp.changed_keys K JOIN {staging_table} S ON {staged_key_match}
+    """)
+    conn.execute("DROP TABLE temp.changed_keys")
+    conn.execute(f"DROP TABLE {staging_table}")
+    return rows_inserted, rows_updated, changed_sale_dates
+
+
+def insert_rows(conn, table_name, df):
+    # Same conversion as DataFrame.to_sql: NaN becomes NULL and numpy scalars become Python values
+    placeholders = ', '.join('?' * len(df.columns))
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", rows)
+
+
+def update_last_loaded_timestamp(table, rows_inserted=None, rows_updated=None):
+    conn = get_connection()
     cursor = conn.cursor()
 
     # Get current datetime
     current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     # Check if the table name already exists in the Timestamps table
-    cursor.execute(f"SELECT COUNT(*) FROM Timestamps WHERE table_name = '{table}'")
+    cursor.execute("SELECT COUNT(*) FROM Timestamps WHERE table_name = ?", (table,))
     exists = cursor.fetchone()[0]
 
     if exists:
-        # Update the timestamp
-        cursor.execute(f"UPDATE Timestamps SET last_loaded = '{current_time}' WHERE table_name = '{table}'")
+        # Update the timestamp and the row counters of the last load
+        cursor.execute("UPDATE Timestamps SET last_loaded = ?, rows_inserted = ?, rows_updated = ? WHERE table_name = ?",
+                       (current_time, rows_inserted, rows_updated, table))
     else:
         # Insert a new record
-        cursor.execute(f"INSERT INTO Timestamps (table_name, last_loaded) VALUES ('{table}', '{current_time}')")
+        cursor.execute("INSERT INTO Timestamps (table_name, last_loaded, rows_inserted, rows_updated) "
+                       "VALUES (?, ?, ?, ?)", (table, current_time, rows_inserted, rows_updated))
 
     conn.commit()
-    conn.close()
+
+    # Timestamps only have a one second resolution, drop cached reports explicitly as well
+    report_cache.clear()
+
+    if app.config['REPORT_SNAPSHOT'] and table in SNAPSHOT_TABLES:
+        refresh_report_snapshot()
 
 
 def get_last_loaded_timestamp(table):
-    conn = sqlite3.connect('sales_management.db')
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT last_loaded FROM Timestamps WHERE table_name = '{table}'")
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        return result[0]
-    return None
+    return get_last_loaded_timestamps([table])[table]
+
+
+def get_last_loaded_timestamps(tables):
+    # Last load time of several tables in one query, None for tables that were never loaded
+    conn = get_connection()
+    placeholders = ', '.join('?' * len(tables))
+    last_loaded = dict(conn.execute(f"SELECT table_name, last_loaded FROM Timestamps WHERE table_name IN ({placeholders})",
+                                    list(tables)).fetchall())
+    return {table: last_loaded.get(table) for table in tables}
 
 
 def ram():
@@ -200,11 +885,36 @@ def ram():
     return process.memory_info().rss / 2 ** 20
 
 
-def run_matching_script():
-    # Connect to the SQLite database
+def read_sql(query, conn, params=None, stage='sql'):
+    # pd.read_sql_query timed as a stage, the SQL and its parameters go to the slow-query log when it takes long
+    with metrics.stage(stage) as timing:
+        df = pd.read_sql_query(query, conn, params=params)
+    if app.config['SLOW_QUERY_SECONDS'] and timing['seconds'] >= app.config['SLOW_QUERY_SECONDS']:
+        metrics.inc('slow_queries_total', stage=stage)
+        SLOW_QUERY_LOGGER.warning(f"{stage} took {timing['seconds']:.3f}s, {len(df)} rows, params={params}: "
+                                  f"{' '.join(query.split())}")
+    return df
+
+
+def run_matching_script(full_rebuild=False, progress=None):
     # Connect to the SQLite database
-    conn = sqlite3.connect('sales_management.db')
+    conn = get_connection()
+
+    # Existing Variations rows stay valid until the Colors or Sizes dictionaries are reloaded. MatchingState
+    # records the Colors / Sizes load timestamps that the last full rebuild was computed from.
+    conn.execute("CREATE TABLE IF NOT EXISTS MatchingState (table_name TEXT PRIMARY KEY, last_loaded TEXT)")
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    matched_against = dict(conn.execute("SELECT table_name, last_loaded FROM MatchingState").fetchall())
+    dictionaries_loaded = get_last_loaded_timestamps(['Colors', 'Sizes'])
+    if 'Variations' not in tables:
+        full_rebuild = True
+    for dictionary_table, dictionary_loaded in dictionaries_loaded.items():
+        if matched_against.get(dictionary_table) != dictionary_loaded:
+            LOGGER.info(f"{dictionary_table} changed since the last matching, rebuilding Variations")
+            full_rebuild = True
+
     # Load data from Sales, Inventory, Colors, and Sizes tables
+    read_start = time.perf_counter()
     sales_data = pd.read_sql_query("SELECT distinct sku FROM Sales where not (sku is null)", conn)
     inventory_data = pd.read_sql_query("SELECT distinct sku FROM Inventory where not (sku is null)", conn)
 
@@ -223,61 +933,53 @@ def run_matching_script():
     # Combine SKU values from Sales and Inventory tables, and remove duplicates
     variation_sku_data = pd.concat([sales_data, inventory_data]).drop_duplicates().reset_index(drop=True)
 
-    # Generate parent SKUs
-    variation_sku_data['parent_sku'] = variation_sku_data['sku'].apply(
-        lambda x: re.match('^[a-zA-Z0-9]*', str(x)).group())
-    
-    def match_item(d, part):
-        matches = [substring for substring in d if (
-                    part.startswith(substring + '-') or 
-                    part.endswith('-' + substring) or 
-                    ('-' + substring + '-') in part or
-                    substring == part
-                   )]
-        if matches:
-            # Sort by length and return the longest match
-            return d[sorted(matches, key=len, reverse=True)[0]]
-        return None
-
-
-    def match_color_size(sku, parent_sku):
-        assert sku is not None
+    # In incremental mode only SKUs that are not in Variations yet are matched
+    if not full_rebuild:
+        existing_skus = pd.read_sql_query("SELECT sku FROM Variations", conn)['sku']
+        variation_sku_data = variation_sku_data[~variation_sku_data['sku'].isin(existing_skus)].reset_index(drop=True)
+    metrics.record_stage('matching.read', time.perf_counter() - read_start)
+    if not full_rebuild and variation_sku_data.empty:
+        LOGGER.info("no new SKUs to match")
+        return 0
 
-        # If the parent_sku and variation_sku are not equal
-        if parent_sku == sku:
-            return None, None
-        # Extract the substring after the first occurrence of a non-alphanumeric character
-        match_part = re.search(r'[^a-zA-Z0-9](.+)', sku)
-        if not match_part:
-            return None, None
+    with metrics.stage('matching.match'):
+        # Generate parent SKUs
+        variation_sku_data['parent_sku'] = variation_sku_data['sku'].astype(str).str.extract(
+            r'^([a-zA-Z0-9]*)', expand=False)
 
-        sku_part = match_part.group(1)
-        color = match_item(colors_data, sku_part)
-        size = match_item(sizes_data, sku_part)
+        # Extract color and size from the SKU suffix of each SKU
+        variation_sku_data[['color', 'size']] = match_color_size(variation_sku_data['sku'], colors_data, sizes_data,
+                                                                 workers=app.config['MATCHING_WORKERS'],
+                                                                 chunk_size=app.config['MATCHING_CHUNK_SIZE'])
 
-        return color, size
+    if progress is not None:
+        progress(len(variation_sku_data))
 
-    # Apply the match_color_size function to each SKU to extract color and size
-    variation_sku_data[['color', 'size']] = variation_sku_data.dropna(subset=['sku']).apply(
-        lambda row: pd.Series(match_color_size(row['sku'].lower(), row['parent_sku'])), axis=1)
     # Save the updated 'Variations' table
+    with metrics.stage('matching.write'):
+        if full_rebuild:
+            # Build the new Variations aside and swap it in, reports keep using the old one meanwhile
+            variations_shadow = shadow_table_name('Variations')
+            variation_sku_data.to_sql(variations_shadow, conn, if_exists='replace', index=False)
+            create_table_indexes(conn, 'Variations', variations_shadow)
+            swap_in_tables(conn, ['Variations'])
+            conn.executemany("INSERT OR REPLACE INTO MatchingState (table_name, last_loaded) VALUES (?, ?)",
+                             list(dictionaries_loaded.items()))
+            conn.commit()
+        else:
+            variation_sku_data.to_sql('Variations', conn, if_exists='append', index=False)
+            create_table_indexes(conn, 'Variations')
+    update_last_loaded_timestamp('Variations')
+
+    LOGGER.info(f"matched {len(variation_sku_data)} SKUs, full_rebuild={full_rebuild}")
+    # Display the matched rows
+    print(variation_sku_data)
+    return len(variation_sku_data)
 
-    variation_sku_data.to_sql('Variations', conn, if_exists='replace', index=False)
-    
-
-    # Query the Variations table and load into a pandas DataFrame
-    df_variations = pd.read_sql_query("SELECT * FROM Variations", conn)
-
-    
-    # Close the connection
-    conn.close()
-
-    # Display the DataFrame
-    print(df_variations)
 
 @app.route('/report', methods=['GET', 'POST'])
 def report(*args, **kwargs):
-    data = None
+    show_table = False
     if request.method == 'POST':
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
@@ -287,13 +989,17 @@ def report(*args, **kwargs):
         session['start_date'] = start_date
         session['end_date'] = end_date
         session['importer'] = importer
+        session['cover_days'] = request.form.get('cover_days', app.config['ORDER_COVER_DAYS'], type=int)
+        session['pack_size'] = request.form.get('pack_size', app.config['ORDER_PACK_SIZE'], type=int)
 
-        data = generate_report_data(start_date, end_date, importer)
+        # Build (and cache) the report now, the table itself fetches its rows page by page from /report_data
+        generate_report_data(start_date, end_date, importer)
+        show_table = True
 
     # This is executed on both POST and GET requests
     unique_importers = ['All'] + get_all_unique_importers()  # Define a function to fetch all unique importers
-    return render_template('report.html', report=data.to_dict(orient='records') if data is not None else None,
-                           unique_importers=unique_importers)
+    return render_template('report.html', show_table=show_table, unique_importers=unique_importers,
+                           **order_settings())
 
 
 @app.route('/show_report', methods=['GET', 'POST'])
@@ -302,36 +1008,69 @@ def show_report():
     end_date = session.get('end_date')
     importer = session.get('importer')
 
-    final_report = generate_report_data(start_date, end_date, importer)
-
     # Handle POST request when "Save CSV" button is clicked
     if request.method == 'POST':
+        final_report = generate_report_data(start_date, end_date, importer)
+
         # Create a dictionary with SKUs as keys and quantities as values
         quantities_dict = {key.split('_')[-1]: int(value) for key, value in request.form.items() if 'quantity_to_order_' in key and value}
 
-        # Extract rows from the final report using the SKUs from the dictionary
-        rows_with_quantity = final_report[final_report['manufacturer_sku'].isin(quantities_dict.keys())]
+        if request.form.get('use_suggestions') == '1':
+            # The sheet was pre-filled, rows the buyer did not touch are ordered as suggested
+            final_report = add_order_suggestions(final_report, start_date, end_date)
+            typed_quantities = final_report['manufacturer_sku'].map(quantities_dict)
+            ordered = typed_quantities.notna() | (final_report['suggested order'] > 0)
+            rows_with_quantity = final_report[ordered].copy()
+            rows_with_quantity['Quantity to Order'] = typed_quantities[ordered].fillna(
+                rows_with_quantity['suggested order']).astype(int)
+            # Suggestions the buyer cleared (or set to 0) are not ordered
+            rows_with_quantity = rows_with_quantity[rows_with_quantity['Quantity to Order'] > 0]
+        else:
+            # Extract rows from the final report using the SKUs from the dictionary
+            rows_with_quantity = final_report[final_report['manufacturer_sku'].isin(quantities_dict.keys())]
+
+            # Assign the quantities to the rows based on SKU
+            rows_with_quantity['Quantity to Order'] = rows_with_quantity['manufacturer_sku'].map(quantities_dict)
 
-        # Assign the quantities to the rows based on SKU
-        rows_with_quantity['Quantity to Order'] = rows_with_quantity['manufacturer_sku'].map(quantities_dict)
-        
-        buf = io.BytesIO()
         desired_columns_for_csv = ['manufacturer_sku', 'product_name', 'color', 'size', 'manufacturer',
                                    'Quantity to Order']
-        rows_with_quantity[desired_columns_for_csv].to_csv(buf, index=False)
-        buf.seek(0)
+        return csv_response(rows_with_quantity[desired_columns_for_csv], 'order_quantities.csv')
 
-        response = send_file(buf, as_attachment=True, download_name='order_quantities.csv', mimetype='text/csv')
-        response.headers["Content-Disposition"] = "attachment; filename=order_quantities.csv"
-        return response
+    return render_template('report.html', show_table=start_date is not None, **order_settings())
 
-    # Filter columns for the view and add a placeholder column for Quantity to Order
-    final_report['Quantity to Order'] = ''  # placeholder for input
-    desired_columns = ['manufacturer', 'manufacturer_sku', 'color', 'size', 'product_name', 'sold quantity',
-                       'Inventory', 'Quantity to Order']
-    final_report = final_report[desired_columns]
 
-    return render_template('report.html', report=final_report.to_dict(orient='records'))
+def order_settings():
+    return {'cover_days': session.get('cover_days', app.config['ORDER_COVER_DAYS']),
+            'pack_size': session.get('pack_size', app.config['ORDER_PACK_SIZE'])}
+
+
+def add_order_suggestions(final_report, start_date, end_date):
+    # The report with a 'suggested order' column, for the cover days and pack size chosen on the report page
+    days = (pd.to_datetime(end_date) - pd.to_datetime(start_date)).days + 1
+    settings = order_settings()
+    with metrics.stage('report.suggestions'):
+        suggested = suggest_order_quantities(final_report['sold quantity'], final_report['Inventory'], days,
+                                             settings['cover_days'], settings['pack_size'])
+        return final_report.assign(**{'suggested order': suggested})
+
+
+@app.route('/report_data', methods=['GET'])
+def report_data():
+    start_date = session.get('start_date')
+    end_date = session.get('end_date')
+    importer = session.get('importer')
+    if start_date is None:
+        return jsonify({'draw': int(request.args.get('draw', 0)), 'recordsTotal': 0, 'recordsFiltered': 0, 'data': []})
+
+    final_report = add_order_suggestions(generate_report_data(start_date, end_date, importer), start_date, end_date)
+
+    # Only the columns shown in the table, the Quantity to Order inputs are rendered client side
+    desired_columns = ['manufacturer', 'manufacturer_sku', 'color', 'size', 'product_name', 'sold quantity',
+                       'Inventory', 'suggested order']
+    with metrics.stage('report.paginate'):
+        page = paginate_datatables(final_report[desired_columns], request.args)
+    with metrics.stage('report.jsonify'):
+        return jsonify(page)
 
 
 @app.route('/download_csv', methods=['GET'])
@@ -342,135 +1081,250 @@ def download_csv():
 
     final_report = generate_report_data(start_date, end_date, importer)
 
-    buf = io.BytesIO()
-    final_report.to_csv(buf, index=False)
-    buf.seek(0)
+    return csv_response(final_report, 'report.csv')
+
+
+@app.route('/period_report', methods=['GET'])
+def period_report():
+    # /period_report?period=month compares the sold quantities of every month of the report range side by side.
+    # period is week, month, <N>d or a comma separated list of bucket start dates (data_processing/periods.py).
+    # start_date, end_date and importer default to the report chosen on the report page. format=csv downloads
+    # the whole report, otherwise one DataTables page is returned with the period labels in 'periods'.
+    start_date = request.args.get('start_date') or session.get('start_date')
+    end_date = request.args.get('end_date') or session.get('end_date')
+    importer = request.args.get('importer') or session.get('importer') or 'All'
+    if start_date is None or end_date is None:
+        return "start_date and end_date are required", 400
+    try:
+        final_report = generate_period_report(start_date, end_date, importer, request.args.get('period', 'month'))
+    except ValueError as e:
+        return str(e), 400
+    labels = list(final_report.columns[final_report.columns.get_loc('Inventory') + 1:])
+
+    if request.args.get('format') == 'csv':
+        return csv_response(final_report, 'period_report.csv')
+
+    desired_columns = ['manufacturer', 'manufacturer_sku', 'color', 'size', 'product_name', 'sold quantity',
+                       'Inventory'] + labels
+    with metrics.stage('report.paginate'):
+        page = paginate_datatables(final_report[desired_columns], request.args)
+    page['periods'] = labels
+    with metrics.stage('report.jsonify'):
+        return jsonify(page)
+
+
+def iter_csv_chunks(df, chunk_rows):
+    # Header first, then the rows in fixed-size batches so only one batch of CSV text exists at a time
+    yield df.iloc[:0].to_csv(index=False).encode('utf-8')
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode('utf-8')
 
-    response = send_file(buf, as_attachment=True, download_name='report.csv', mimetype='text/csv')
-    response.headers["Content-Disposition"] = "attachment; filename=report.csv"
-    return response
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def csv_response(df, filename):
+    body = iter_csv_chunks(df, app.config['CSV_CHUNK_ROWS'])
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if app.config['CSV_GZIP'] and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return Response(body, mimetype='text/csv', headers=headers)
+
+
+@app.route('/report_cache', methods=['GET'])
+def report_cache_stats():
+    return jsonify(report_cache.stats())
 
 
 @app.route('/run-matching', methods=['GET'])
 def run_matching():
+    # /run-matching?full=1 rebuilds every Variations row, otherwise only new SKUs are matched
+    full_rebuild = request.args.get('full') == '1'
+    if app.config['BACKGROUND_JOBS']:
+        job_id = job_runner.submit('matching', 'Variations', run_matching_job, full_rebuild)
+        flash(f'Data matching started as job {job_id}')
+        return redirect('/')
     try:
-        run_matching_script()
-        flash('Data processing was successful!')
+        matched_count = run_matching_script(full_rebuild=full_rebuild)
+        flash(f'Data processing was successful! Matched {matched_count} SKUs.')
     except Exception as e:
         flash(f"Error processing data: {str(e)}")
     return redirect('/')
 
 
+def run_matching_job(full_rebuild, progress=None):
+    matched_count = run_matching_script(full_rebuild=full_rebuild, progress=progress)
+    return f'Matched {matched_count} SKUs'
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(job_runner.recent(int(request.args.get('limit', 20))))
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': f'no job {job_id}'}), 404
+    return jsonify(job)
+
+
+# How each uploaded export is loaded: its columns and their names in the database, the number of title rows
+# above the header, and for tables that support add/update uploads the columns identifying a row
+# Identifiers (SKUs, barcodes, document numbers, color and size keys) are read as text in every chunk, so a
+# file whose first chunk looks numeric keeps leading zeros and letters in its later chunks.
+TABLE_IMPORTS = {
+    'Products': {
+        'columns': {
+            "מזהה": "linet_id",
+            "מקט": "sku",
+            "מקט יצרן": "manufacturer_sku",
+            "סוג פריט": "item_type",
+            "שם": "product_name",
+            "יבואן": "importer",
+            "יצרן": "manufacturer",
+            "קטגוריה ראשית": "main_category",
+            "מחיר רכישה": "purchase_price",
+            "מחיר מכירה": "consumer_price"
+        },
+        'dtype': {"מקט": str, "מקט יצרן": str},
+        'skiprows': 1,
+    },
+    'Sales': {
+        'columns': {
+            "מקט": "sku",
+            "שם פריט": "product_name",
+            "סוג מסמך": "document_type",
+            "מספר מסמך": "document_number",
+            "מזהה חשבון": "account_id",
+            "חברה": "company",
+            "מחיר פריט (לפני מעמ)": "item_price_before_tax",
+            "כמות": "quantity",
+            "סך שורה לפני מעמ": "total_line_before_tax",
+            "תאריך הפקה": "issue_date"
+        },
+        'dtype': {"מקט": str, "סוג מסמך": str, "מספר מסמך": str, "מזהה חשבון": str, "תאריך הפקה": str},
+        'skiprows': 1,
+        # Sales lines are identified by their document and SKU
+        'key_columns': ['document_type', 'document_number', 'sku'],
+    },
+    'Inventory': {
+        'columns': {
+            "מקט": "sku",
+            "מקט יצרן": "manufacturer_sku",
+            "שם פריט": "item_name",
+            "כמות": "quantity"
+        },
+        'dtype': {"מקט": str, "מקט יצרן": str},
+        'skiprows': 1,
+        # An Inventory upload is a snapshot of the SKUs it contains, other SKUs keep their rows
+        'key_columns': ['sku'],
+    },
+    'Colors': {
+        'columns': {
+            "name": "color_name",
+            "Slug": "Slug",
+            "value": "value"
+        },
+        'dtype': {"Slug": str, "value": str},
+        'skiprows': 0,
+    },
+    'Sizes': {
+        'columns': {
+            "name": "size_name",
+            "Slug": "Slug",
+            "value": "value"
+        },
+        'dtype': {"Slug": str, "value": str},
+        'skiprows': 0,
+    },
+    'BarcodesForVariations': {
+        'columns': {
+            "מקט": "sku",
+            "מקט יצרן": "manufacturer_sku"
+        },
+        'dtype': {"מקט": str, "מקט יצרן": str},
+        'skiprows': 1,
+    },
+}
+
+
+def import_table(table_type, file_stream, upsert=False, progress=None):
+    table_import = TABLE_IMPORTS[table_type]
+    key_columns = table_import.get('key_columns') if upsert else None
+    rows_inserted, rows_updated = import_csv_to_db(file_stream, table_type, list(table_import['columns']),
+                                                   table_import['columns'], skiprows=table_import['skiprows'],
+                                                   key_columns=key_columns, progress=progress,
+                                                   dtype=table_import.get('dtype'))
+    update_last_loaded_timestamp(table_type, rows_inserted, rows_updated)
+    return f'{rows_inserted} rows inserted, {rows_updated} rows updated'
+
+
+def import_uploaded_file(table_type, upload_path, upsert, progress=None):
+    try:
+        with open(upload_path, 'rb') as file_stream:
+            return import_table(table_type, file_stream, upsert, progress=progress)
+    finally:
+        os.remove(upload_path)
+
+
+def spool_upload(stream):
+    # Copy the upload to a temporary file in fixed-size blocks, the job reads it after the request is gone
+    with tempfile.NamedTemporaryFile(prefix='upload_', suffix='.csv', delete=False) as upload_file:
+        shutil.copyfileobj(stream, upload_file)
+    return upload_file.name
+
+
 @app.route('/', methods=['GET', 'POST'])
 def choose_file():
     LOGGER.debug(f"Handling upload request, method={request.method}")
     if request.method == 'POST':
         file = request.files['file']
         table_type = request.form.get('table_type')  # Get the type of table selected by the user
+        # Sales and Inventory can be merged into the existing rows instead of replacing the table
+        upsert = request.form.get('import_mode') == 'upsert'
 
         if file.filename == '':
             flash('No selected file')
             return redirect(request.url)
 
+        if table_type not in TABLE_IMPORTS:
+            flash(f'Unknown table type {table_type}')
+            return redirect(request.url)
+
         if file:
             LOGGER.debug(f"found file, table_type={table_type}")
-            file_content = file.stream.read().decode('utf-8')
-            LOGGER.debug(f"read file - {len(file_content)} bytes")
-
-            if table_type == "Products":
-                catalog_columns = ["מזהה", "מקט", "מקט יצרן", "סוג פריט", "שם", "יבואן", "יצרן", "קטגוריה ראשית",
-                                   "מחיר רכישה", "מחיר מכירה"]
-                catalog_columns_rename = {
-                    "מזהה": "linet_id",
-                    "מקט": "sku",
-                    "מקט יצרן": "manufacturer_sku",
-                    "סוג פריט": "item_type",
-                    "שם": "product_name",
-                    "יבואן": "importer",
-                    "יצרן": "manufacturer",
-                    "קטגוריה ראשית": "main_category",
-                    "מחיר רכישה": "purchase_price",
-                    "מחיר מכירה": "consumer_price"
-                }
-                import_csv_to_db(file_content, 'Products', catalog_columns, catalog_columns_rename, skiprows=1)
-                update_last_loaded_timestamp('Products')
-            elif table_type == "Sales":
-                sales_columns = ["מקט", "שם פריט", "סוג מסמך", "מספר מסמך", "מזהה חשבון", "חברה",
-                                 "מחיר פריט (לפני מעמ)", "כמות", "סך שורה לפני מעמ", "תאריך הפקה"]
-                sales_columns_rename = {
-                    "מקט": "sku",
-                    "שם פריט": "product_name",
-                    "סוג מסמך": "document_type",
-                    "מספר מסמך": "document_number",
-                    "מזהה חשבון": "account_id",
-                    "חברה": "company",
-                    "מחיר פריט (לפני מעמ)": "item_price_before_tax",
-                    "כמות": "quantity",
-                    "סך שורה לפני מעמ": "total_line_before_tax",
-                    "תאריך הפקה": "issue_date"
-                }
-                import_csv_to_db(file_content, 'Sales', sales_columns, sales_columns_rename, skiprows=1)
-                update_last_loaded_timestamp('Sales')
-
-            elif table_type == "Inventory":
-                inventory_columns = ["מקט", "מקט יצרן", "שם פריט", "כמות"]
-                inventory_columns_rename = {
-                    "מקט": "sku",
-                    "מקט יצרן": "manufacturer_sku",
-                    "שם פריט": "item_name",
-                    "כמות": "quantity"
-                }
-                import_csv_to_db(file_content, 'Inventory', inventory_columns, inventory_columns_rename, skiprows=1)
-                update_last_loaded_timestamp('Inventory')
-
-            elif table_type == "Colors":
-                colors_columns = ["name", "Slug", "value"]
-                colors_columns_rename = {
-                    "name": "color_name",
-                    "Slug": "Slug",
-                    "value": "value"
-                }
-                import_csv_to_db(file_content, 'Colors', colors_columns, colors_columns_rename, skiprows=0)
-                update_last_loaded_timestamp('Colors')
-
-            elif table_type == "Sizes":
-                sizes_columns = ["name", "Slug", "value"]
-                sizes_columns_rename = {
-                    "name": "size_name",
-                    "Slug": "Slug",
-                    "value": "value"
-                }
-                import_csv_to_db(file_content, 'Sizes', sizes_columns, sizes_columns_rename, skiprows=0)
-                update_last_loaded_timestamp('Sizes')
-
-            elif table_type == "BarcodesForVariations":
-                barcodes_columns = ["מקט", "מקט יצרן"]
-                barcodes_columns_rename = {
-                    "מקט": "sku",
-                    "מקט יצרן": "manufacturer_sku"
-                }
-                import_csv_to_db(file_content, 'BarcodesForVariations', barcodes_columns, barcodes_columns_rename,
-                                 skiprows=1)
-                update_last_loaded_timestamp('BarcodesForVariations')
-
-            # You can continue the structure for additional tables as needed.
-
-            flash(f'{table_type} file successfully uploaded and processed')
+            if app.config['BACKGROUND_JOBS']:
+                job_id = job_runner.submit('import', table_type, import_uploaded_file, table_type,
+                                           spool_upload(file.stream), upsert)
+                flash(f'{table_type} file uploaded, processing it as job {job_id}')
+            else:
+                # The upload is parsed straight from its stream, chunk by chunk
+                result = import_table(table_type, file.stream, upsert)
+                flash(f'{table_type} file successfully uploaded and processed ({result})')
 
     # Capture the current time
     current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    last_loaded_products = get_last_loaded_timestamp('Products')
-    last_loaded_Sales = get_last_loaded_timestamp('Sales')
-    last_loaded_Inventory = get_last_loaded_timestamp('Inventory')
-    last_loaded_Colors = get_last_loaded_timestamp('Colors')
-    last_loaded_Sizes = get_last_loaded_timestamp('Sizes')
-    last_loaded_BarcodesForVariations = get_last_loaded_timestamp('BarcodesForVariations')
-
-    return render_template('index.html', current_time=current_time, last_loaded_products=last_loaded_products,
-                           last_loaded_Sales=last_loaded_Sales, last_loaded_Inventory=last_loaded_Inventory,
-                           last_loaded_Colors=last_loaded_Colors, last_loaded_Sizes=last_loaded_Sizes,
-                           last_loaded_BarcodesForVariations=last_loaded_BarcodesForVariations)
+    last_loaded = get_last_loaded_timestamps(['Products', 'Sales', 'Inventory', 'Colors', 'Sizes',
+                                              'BarcodesForVariations'])
+
+    return render_template('index.html', current_time=current_time, last_loaded_products=last_loaded['Products'],
+                           last_loaded_Sales=last_loaded['Sales'], last_loaded_Inventory=last_loaded['Inventory'],
+                           last_loaded_Colors=last_loaded['Colors'], last_loaded_Sizes=last_loaded['Sizes'],
+                           last_loaded_BarcodesForVariations=last_loaded['BarcodesForVariations'],
+                           jobs=job_runner.recent(10))
+
 
+upgrade_database()
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,237 @@
+# run_benchmarks.py
+#
+# Runs the import, matching and report paths of app.py against synthetic exports at several scales and
+# writes wall time, rows per second and peak RSS of every stage to a JSON results file.
+#
+#   python -m benchmarks.run_benchmarks --scales 100000 1000000
+#   python -m benchmarks.run_benchmarks --scales 100000 --compare benchmark_results/<earlier run>.json
+#
+# Every scale runs in a fresh process against its own temporary database, so peak RSS is not inflated by
+# earlier scales. Settings read by app.py from the environment (USE_SALES_ROLLUP, REPORT_SNAPSHOT,
+# MATCHING_WORKERS, ...) apply to the benchmarked code and are recorded in the results.
+
+import argparse
+import contextlib
+import datetime
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from benchmarks.synthetic_data import generate, generate_new_skus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RECORDED_SETTINGS = ['USE_SALES_ROLLUP', 'REPORT_SNAPSHOT', 'MATCHING_WORKERS', 'MATCHING_CHUNK_SIZE',
+                     'IMPORT_CHUNK_ROWS', 'SQLITE_CACHE_SIZE_KB', 'SQLITE_MMAP_SIZE_MB']
+
+
+# Samples the process RSS in a background thread while a stage runs
+class PeakRss:
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+
+    def _rss_mb(self):
+        return self._process.memory_info().rss / 2 ** 20
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, self._rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = self._rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = self._rss_mb()
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+
+
+def count_lines(path, header_lines):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f) - header_lines
+
+
+def run_scale(sales_rows, workdir, seed):
+    # Runs in the child process. DATABASE, JOBS_DATABASE and REPORT_SNAPSHOT_DIR already point into workdir.
+    generate_start = time.perf_counter()
+    paths = generate(os.path.join(workdir, 'data'), sales_rows, seed=seed)
+    generate_seconds = time.perf_counter() - generate_start
+
+    # app.py prints every query and CSV header, keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+
+    results = []
+
+    # rows=None records the number of rows func returns
+    def stage(name, rows, func, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()), PeakRss() as rss:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            seconds = time.perf_counter() - start
+        if rows is None:
+            rows = result
+        results.append({
+            'scale': sales_rows,
+            'stage': name,
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None,
+            'start_rss_mb': round(rss.start_mb, 1),
+            'peak_rss_mb': round(rss.peak_mb, 1),
+        })
+        print(f"  {sales_rows:>10} {name:<30} {rows:>10} rows {seconds:9.3f} s  peak {rss.peak_mb:8.1f} MB",
+              file=sys.stderr)
+
+    def import_file(table_name, upsert=False):
+        with open(paths[table_name], 'rb') as file_stream:
+            app.import_table(table_name, file_stream, upsert=upsert)
+
+    for table_name in ['Colors', 'Sizes', 'Products', 'Inventory', 'BarcodesForVariations', 'Sales']:
+        header_lines = app.TABLE_IMPORTS[table_name]['skiprows'] + 1
+        stage(f"import_{table_name}", count_lines(paths[table_name], header_lines), import_file, table_name)
+    # Re-importing the same file in add/update mode measures the comparison against existing rows
+    stage("import_Sales_upsert", sales_rows, import_file, 'Sales', upsert=True)
+
+    sku_count = app.get_connection().execute(
+        "SELECT COUNT(*) FROM (SELECT sku FROM Sales UNION SELECT sku FROM Inventory)").fetchone()[0]
+    stage("matching_full", sku_count, app.run_matching_script, full_rebuild=True)
+    # An Inventory upload with about 1% new products gives incremental matching new SKUs to match
+    new_skus_path = generate_new_skus(os.path.join(workdir, 'data', 'InventoryNewSkus.csv'),
+                                      max(1, sales_rows // 10000), seed=seed)
+    with open(new_skus_path, 'rb') as file_stream, contextlib.redirect_stdout(io.StringIO()):
+        app.import_table('Inventory', file_stream, upsert=True)
+    stage("matching_incremental", None, app.run_matching_script)
+
+    # The synthetic sales span 2022 and 2023
+    app.report_cache.clear()
+    stage("report_full_range", sales_rows, app.generate_report_data, '2022-01-01', '2023-12-31', 'All')
+    stage("report_full_range_cached", sales_rows, app.generate_report_data, '2022-01-01', '2023-12-31', 'All')
+    app.report_cache.clear()
+    month_rows = app.get_connection().execute(
+        "SELECT COUNT(*) FROM Sales WHERE sale_date BETWEEN '2023-06-01' AND '2023-06-30'").fetchone()[0]
+    stage("report_one_month", month_rows, app.generate_report_data, '2023-06-01', '2023-06-30', 'All')
+    importer = app.get_all_unique_importers()[0]
+    stage("report_full_range_importer", sales_rows, app.generate_report_data, '2022-01-01', '2023-12-31', importer)
+    # 24 monthly columns in one scan, compare with 24 report_one_month runs
+    stage("period_report_monthly", sales_rows, app.generate_period_report, '2022-01-01', '2023-12-31', 'All', 'month')
+    stage("period_report_weekly", sales_rows, app.generate_period_report, '2022-01-01', '2023-12-31', 'All', 'week')
+
+    return {
+        'scale': sales_rows,
+        'generate_seconds': round(generate_seconds, 3),
+        'database_mb': round(os.path.getsize(os.environ['DATABASE']) / 2 ** 20, 1),
+        'settings': {name: app.app.config[name] for name in RECORDED_SETTINGS},
+        'results': results,
+    }
+
+
+def spawn_scale(sales_rows, seed, keep):
+    # Run one scale in a child process with its own temporary database
+    workdir = tempfile.mkdtemp(prefix=f"benchmark_{sales_rows}_")
+    scale_output = os.path.join(workdir, 'results.json')
+    env = dict(os.environ,
+               DATABASE=os.path.join(workdir, 'sales_management.db'),
+               JOBS_DATABASE=os.path.join(workdir, 'jobs.db'),
+               REPORT_SNAPSHOT_DIR=os.path.join(workdir, 'report_snapshot'))
+    try:
+        subprocess.run([sys.executable, '-m', 'benchmarks.run_benchmarks', '--child', str(sales_rows),
+                        '--workdir', workdir, '--seed', str(seed), '--output', scale_output],
+                       env=env, cwd=REPO_ROOT, check=True)
+        with open(scale_output) as f:
+            return json.load(f)
+    finally:
+        if keep:
+            print(f"  kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    # Print the change of every stage that appears in both runs
+    previous_results = {(r['scale'], r['stage']): r for scale in previous['scales'] for r in scale['results']}
+    print(f"\ncomparing with {previous['meta'].get('commit')} from {previous['meta'].get('started_at')}")
+    print(f"{'scale':>10} {'stage':<30} {'before s':>10} {'after s':>10} {'time':>8} {'peak MB':>15}")
+    for scale in current['scales']:
+        for r in scale['results']:
+            before = previous_results.get((r['scale'], r['stage']))
+            if before is None:
+                continue
+            change = (r['seconds'] / before['seconds'] - 1) * 100 if before['seconds'] else 0
+            print(f"{r['scale']:>10} {r['stage']:<30} {before['seconds']:>10.3f} {r['seconds']:>10.3f} "
+                  f"{change:>+7.1f}% {before['peak_rss_mb']:>7.0f}->{r['peak_rss_mb']:<7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark imports, matching and reports on synthetic data")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000],
+                        help="numbers of Sales rows to benchmark")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="results file (default benchmark_results/<time>-<commit>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare with")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary databases and CSVs")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run_scale(args.child, args.workdir, args.seed), f)
+        return
+
+    started_at = datetime.datetime.now()
+    run = {
+        'meta': {
+            'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': importlib.metadata.version('pandas'),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+        },
+        'scales': [],
+    }
+    for sales_rows in args.scales:
+        print(f"benchmarking {sales_rows} Sales rows", file=sys.stderr)
+        run['scales'].append(spawn_scale(sales_rows, args.seed, args.keep))
+
+    output = args.output or os.path.join(
+        'benchmark_results', f"{started_at:%Y%m%d-%H%M%S}-{run['meta']['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == '__main__':
+    main()
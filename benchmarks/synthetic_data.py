@@ -0,0 +1,128 @@
+# synthetic_data.py
+
+import csv
+import datetime
+import os
+import random
+
+# Colors and Sizes exports: (name, Slug, value). SKU suffixes use either the slug or the value.
+COLORS = [
+    ("אדום", "red", "red"),
+    ("כחול כהה", "dark-blue", "navy"),
+    ("כחול", "blue", "blu"),
+    ("שחור", "black", "blk"),
+    ("לבן", "white", "wht"),
+    ("ירוק בהיר", "light-green", "lgreen"),
+    ("אפור", "grey", "gray"),
+    ("ורוד", "pink", "pnk"),
+]
+SIZES = [
+    ("קטן", "s", "small"),
+    ("בינוני", "m", "medium"),
+    ("גדול", "l", "large"),
+    ("גדול מאוד", "xl", "x-large"),
+    ("XXL", "xxl", "2x-large"),
+    ("36", "36", "eu36"),
+    ("38", "38", "eu38"),
+    ("40", "40", "eu40"),
+    ("42", "42", "eu42"),
+]
+
+PRODUCTS_HEADER = ["מזהה", "מקט", "מקט יצרן", "סוג פריט", "שם", "יבואן", "יצרן", "קטגוריה ראשית", "מחיר רכישה",
+                   "מחיר מכירה"]
+SALES_HEADER = ["מקט", "שם פריט", "סוג מסמך", "מספר מסמך", "מזהה חשבון", "חברה", "מחיר פריט (לפני מעמ)", "כמות",
+                "סך שורה לפני מעמ", "תאריך הפקה"]
+INVENTORY_HEADER = ["מקט", "מקט יצרן", "שם פריט", "כמות"]
+BARCODES_HEADER = ["מקט", "מקט יצרן"]
+
+PRODUCT_NAMES = ["חולצה", "מכנסיים", "שמלה", "חצאית", "מעיל", "סוודר", "גרביים", "כובע"]
+IMPORTERS = ["יבואן א", "יבואן ב", "יבואן ג", "יבואן ד"]
+CATEGORIES = ["נשים", "גברים", "ילדים", "אביזרים"]
+DOCUMENT_TYPES = ["חשבונית מס", "חשבונית מס קבלה", "תעודת משלוח"]
+
+
+def _write_csv(path, header, rows, title=True):
+    # The ERP exports start with a title line above the header, Colors and Sizes do not
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        if title:
+            writer.writerow(["דוח"])
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _variation_skus(rng, parent_sku):
+    # Most products come in several color/size combinations, written with slugs or values, some only by color
+    skus = {parent_sku}
+    for _ in range(rng.randint(0, 6)):
+        color = rng.choice(COLORS)[rng.choice([1, 2])]
+        size = rng.choice(SIZES)[rng.choice([1, 2])]
+        skus.add(f"{parent_sku}-{color}-{size}" if rng.random() < 0.85 else f"{parent_sku}-{color}")
+    return sorted(skus)
+
+
+# Write a full set of synthetic exports with sales_rows Sales lines into directory and return their paths by
+# table name. The catalog grows with the number of sales lines (about one SKU per 25 lines).
+def generate(directory, sales_rows, seed=1):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = {table_name: os.path.join(directory, f"{table_name}.csv") for table_name in
+             ['Products', 'Sales', 'Inventory', 'Colors', 'Sizes', 'BarcodesForVariations']}
+
+    parent_count = max(20, sales_rows // 100)
+    parents = [f"{rng.choice('ABCDEFGH')}{i:06d}" for i in range(parent_count)]
+    skus = [sku for parent in parents for sku in _variation_skus(rng, parent)]
+
+    _write_csv(paths['Colors'], ["name", "Slug", "value"], COLORS, title=False)
+    _write_csv(paths['Sizes'], ["name", "Slug", "value"], SIZES, title=False)
+
+    # A few parents are missing from the catalog, their sales show up without product details
+    _write_csv(paths['Products'], PRODUCTS_HEADER, (
+        [i, parent, f"M-{parent}", "variable", f"{rng.choice(PRODUCT_NAMES)} {parent}", rng.choice(IMPORTERS),
+         f"יצרן {rng.randint(1, 40)}", rng.choice(CATEGORIES), round(rng.uniform(5, 200), 2), rng.randint(20, 500)]
+        for i, parent in enumerate(parents) if rng.random() < 0.97
+    ))
+
+    first_day = datetime.date(2022, 1, 1)
+    # Popular SKUs sell much more than the long tail
+    weights = [1 / (rank + 1) for rank in range(len(skus))]
+    rng.shuffle(weights)
+
+    def sales_lines():
+        document_number = 100000
+        sold_skus = rng.choices(skus, weights=weights, k=sales_rows)
+        for line, sku in enumerate(sold_skus):
+            if line % 3 == 0:
+                document_number += 1
+                issue_date = first_day + datetime.timedelta(days=rng.randrange(730))
+            price = round(rng.uniform(20, 500), 2)
+            quantity = rng.choice([1, 1, 1, 2, 2, 3, 5, -1])
+            yield [sku, f"פריט {sku}", rng.choice(DOCUMENT_TYPES), f"{document_number}-{line % 3}",
+                   rng.randint(1, 5000), "החברה שלי", price, quantity, round(price * quantity, 2),
+                   f"{issue_date:%d/%m/%Y} {rng.randint(8, 20):02d}:{rng.randint(0, 59):02d}"]
+
+    _write_csv(paths['Sales'], SALES_HEADER, sales_lines())
+    _write_csv(paths['Inventory'], INVENTORY_HEADER, (
+        [sku, f"M-{sku}", f"פריט {sku}", rng.randint(0, 60)] for sku in skus if rng.random() < 0.7
+    ))
+
+    def barcode_lines():
+        for sku in skus:
+            if rng.random() < 0.4:
+                line = [sku, f"729{rng.randrange(10 ** 9):09d}"]
+                yield line
+                # Exports repeat some lines
+                if rng.random() < 0.05:
+                    yield line
+
+    _write_csv(paths['BarcodesForVariations'], BARCODES_HEADER, barcode_lines())
+    return paths
+
+
+# Write an Inventory export of parent_count products that generate() never creates (their SKUs start with N),
+# for measuring incremental matching after an upload, and return its path
+def generate_new_skus(path, parent_count, seed=1):
+    rng = random.Random(seed)
+    skus = [sku for i in range(parent_count) for sku in _variation_skus(rng, f"N{i:06d}")]
+    _write_csv(path, INVENTORY_HEADER, ([sku, f"M-{sku}", f"פריט {sku}", rng.randint(0, 60)] for sku in skus))
+    return path
@@ -0,0 +1,3 @@
+# conftest.py
+#
+# Lets the tests import app and data_processing from the repository root
@@ -0,0 +1,51 @@
+# db.py
+
+import sqlite3
+import threading
+
+# Connection settings, set once at startup through configure()
+SETTINGS = {
+    'database': 'sales_management.db',
+    # Seconds a writer waits for another writer before giving up
+    'busy_timeout': 600,
+    # Page cache per connection in KiB, and how much of the file is memory-mapped
+    'cache_size_kb': 65536,
+    'mmap_size': 256 * 2 ** 20,
+}
+
+_local = threading.local()
+
+
+def configure(**settings):
+    SETTINGS.update(settings)
+
+
+def _connect():
+    conn = sqlite3.connect(SETTINGS['database'], timeout=SETTINGS['busy_timeout'], cached_statements=256)
+    # WAL lets readers keep going while an import writes, NORMAL sync is durable enough in WAL mode
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(SETTINGS['cache_size_kb'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(SETTINGS['mmap_size'])}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+# One connection per thread, opened on first use and kept for the thread's lifetime. sqlite3 caches the
+# prepared form of every parameterized statement on its connection, so reusing it also reuses those.
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.database != SETTINGS['database']:
+        if conn is not None:
+            conn.close()
+        conn = _connect()
+        _local.conn = conn
+        _local.database = SETTINGS['database']
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
@@ -0,0 +1,178 @@
+# jobs.py
+
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+LOGGER = logging.getLogger('mainApp.jobs')
+
+
+def _now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _ram():
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+# A process is identified by its pid and start time, so a pid reused after a restart is not mistaken for the owner
+def _process_owner(pid=None):
+    process = psutil.Process(pid)
+    return f"{process.pid}:{process.create_time()}"
+
+
+def _owner_alive(owner):
+    pid, _, create_time = (owner or '').partition(':')
+    try:
+        return psutil.Process(int(pid)).create_time() == float(create_time)
+    except (ValueError, psutil.Error):
+        return False
+
+
+# Runs uploads and matching in background threads and records their progress in the Jobs table.
+# Jobs touching the same table are serialized by a per-table lock, unrelated jobs run side by side.
+# Several app processes may share the jobs database: each job records the process that owns it, and the
+# per-table locks are rows of TableLocks, so a job waits for jobs on its table in every process.
+# The Jobs table lives in its own database file, so progress updates never wait for the long write
+# transaction of the import they are reporting on.
+class JobRunner:
+    # Seconds between attempts to take a table held by a job of another process
+    LOCK_POLL_SECONDS = 1
+
+    # teardown is called in the worker thread after each job, e.g. to close the thread's database connection
+    def __init__(self, database, max_workers=2, teardown=None):
+        self.database = database
+        self.teardown = teardown
+        self.owner = _process_owner()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._table_locks = defaultdict(threading.Lock)
+        self._table_locks_guard = threading.Lock()
+        self._create_table()
+
+    def _connect(self):
+        return sqlite3.connect(self.database)
+
+    def _create_table(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS Jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                table_name TEXT,
+                status TEXT,
+                rows_processed INTEGER,
+                elapsed_seconds REAL,
+                peak_ram_mb REAL,
+                message TEXT,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        if 'owner' not in [row[1] for row in conn.execute("PRAGMA table_info(Jobs)")]:
+            conn.execute("ALTER TABLE Jobs ADD COLUMN owner TEXT")
+        conn.execute("CREATE TABLE IF NOT EXISTS TableLocks (table_name TEXT PRIMARY KEY, owner TEXT, job_id INTEGER)")
+        # Jobs that were queued or running in a process that has stopped will never finish.
+        # Jobs of processes still running are theirs to finish.
+        unfinished = conn.execute("SELECT job_id, owner FROM Jobs WHERE status IN ('queued', 'running')").fetchall()
+        conn.executemany("UPDATE Jobs SET status = 'failed', message = 'interrupted by a restart' WHERE job_id = ?",
+                         [(job_id,) for job_id, owner in unfinished if not _owner_alive(owner)])
+        conn.commit()
+        conn.close()
+
+    def _update(self, job_id, **fields):
+        conn = self._connect()
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        conn.execute(f"UPDATE Jobs SET {assignments} WHERE job_id = ?", list(fields.values()) + [job_id])
+        conn.commit()
+        conn.close()
+
+    def submit(self, kind, table_name, func, *args):
+        # func is called as func(*args, progress=callback) and may call callback(rows_processed) as it goes.
+        # Its return value is stored as the job message.
+        conn = self._connect()
+        cursor = conn.execute("INSERT INTO Jobs (kind, table_name, status, rows_processed, created_at, owner) "
+                              "VALUES (?, ?, 'queued', 0, ?, ?)", (kind, table_name, _now(), self.owner))
+        job_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        self._executor.submit(self._run, job_id, table_name, func, args)
+        return job_id
+
+    def _table_lock(self, table_name):
+        with self._table_locks_guard:
+            return self._table_locks[table_name]
+
+    def _acquire_table(self, job_id, table_name):
+        # Called with the thread lock of the table held, so a TableLocks row of this process is left over
+        while True:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner FROM TableLocks WHERE table_name = ?", (table_name,)).fetchone()
+            if row is None or row[0] == self.owner or not _owner_alive(row[0]):
+                conn.execute("INSERT OR REPLACE INTO TableLocks (table_name, owner, job_id) VALUES (?, ?, ?)",
+                             (table_name, self.owner, job_id))
+                conn.commit()
+                conn.close()
+                return
+            conn.rollback()
+            conn.close()
+            time.sleep(self.LOCK_POLL_SECONDS)
+
+    def _release_table(self, table_name):
+        conn = self._connect()
+        conn.execute("DELETE FROM TableLocks WHERE table_name = ? AND owner = ?", (table_name, self.owner))
+        conn.commit()
+        conn.close()
+
+    def _run(self, job_id, table_name, func, args):
+        with self._table_lock(table_name):
+            self._acquire_table(job_id, table_name)
+            try:
+                self._run_locked(job_id, func, args)
+            finally:
+                self._release_table(table_name)
+                if self.teardown is not None:
+                    self.teardown()
+
+    def _run_locked(self, job_id, func, args):
+        started = time.time()
+        peak_ram = _ram()
+        self._update(job_id, status='running', started_at=_now())
+
+        def progress(rows_processed):
+            nonlocal peak_ram
+            peak_ram = max(peak_ram, _ram())
+            self._update(job_id, rows_processed=rows_processed, elapsed_seconds=time.time() - started,
+                         peak_ram_mb=peak_ram)
+
+        try:
+            result = func(*args, progress=progress)
+            status, message = 'done', None if result is None else str(result)
+        except Exception as e:
+            LOGGER.exception(f"job {job_id} failed")
+            status, message = 'failed', str(e)
+        peak_ram = max(peak_ram, _ram())
+        self._update(job_id, status=status, message=message, finished_at=_now(),
+                     elapsed_seconds=time.time() - started, peak_ram_mb=peak_ram)
+
+    def get(self, job_id):
+        jobs = self._select("WHERE job_id = ?", [job_id])
+        return jobs[0] if jobs else None
+
+    def recent(self, limit=10):
+        return self._select("ORDER BY job_id DESC LIMIT ?", [limit])
+
+    def _select(self, clause, params):
+        conn = self._connect()
+        cursor = conn.execute(f"SELECT * FROM Jobs {clause}", params)
+        columns = [description[0] for description in cursor.description]
+        jobs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        conn.close()
+        return jobs
@@ -0,0 +1,107 @@
+# logs.py
+
+import datetime
+import logging
+import os
+import re
+import time
+
+# Records start with "<date> <time>,<msecs> <logger> <LEVEL> "; lines that do not (tracebacks, multi-line
+# messages) belong to the record above them
+RECORD_START = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ \S+ ([A-Z]+) ')
+
+
+def parse_cursor(cursor):
+    # Cursors are "<inode>:<byte offset>" of the log file, the inode tells when the file was rotated
+    try:
+        inode, offset = cursor.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def read_lines(path, cursor=None, tail_bytes=None, max_bytes=2 ** 20):
+    # Complete lines written after cursor (at most max_bytes of them) and the cursor to continue from. Without a
+    # cursor reading starts tail_bytes before the end of the file, or at the end when it is None. A cursor from
+    # before a rotation starts over at the beginning of the new file.
+    stat = os.stat(path)
+    position = parse_cursor(cursor)
+    if position is not None and position[0] == stat.st_ino and position[1] <= stat.st_size:
+        offset = position[1]
+        skip_partial_line = False
+    elif position is not None:
+        offset, skip_partial_line = 0, False
+    elif tail_bytes is None:
+        offset, skip_partial_line = stat.st_size, False
+    else:
+        offset = max(stat.st_size - tail_bytes, 0)
+        skip_partial_line = offset > 0
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(min(stat.st_size - offset, max_bytes))
+    if skip_partial_line:
+        line_end = data.find(b'\n') + 1
+        data, offset = data[line_end:], offset + line_end
+    # A line that is still being written is picked up by the next read, unless it alone fills max_bytes
+    line_end = data.rfind(b'\n') + 1
+    complete = data[:line_end] if line_end or len(data) < max_bytes else data
+    lines = complete.decode('utf-8', errors='replace').splitlines()
+    return lines, f"{stat.st_ino}:{offset + len(complete)}"
+
+
+# Keeps the records at or above min_level whose time is within [since, until]. Continuation lines follow the
+# decision made for their record. Feed it consecutive batches of lines, it remembers the last record.
+class LogFilter:
+
+    def __init__(self, min_level=None, since=None, until=None):
+        self.min_level = logging.getLevelName(min_level.upper()) if min_level else None
+        if not isinstance(self.min_level, (int, type(None))):
+            raise ValueError(f"unknown log level {min_level}")
+        self.since = since
+        self.until = until
+        self._keep = not self.active
+
+    @property
+    def active(self):
+        return self.min_level is not None or self.since is not None or self.until is not None
+
+    def apply(self, lines):
+        if not self.active:
+            return lines
+        kept = []
+        for line in lines:
+            match = RECORD_START.match(line)
+            if match:
+                timestamp = datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')
+                level = logging.getLevelName(match.group(2))
+                self._keep = ((self.min_level is None or (isinstance(level, int) and level >= self.min_level)) and
+                              (self.since is None or timestamp >= self.since) and
+                              (self.until is None or timestamp <= self.until))
+            if self._keep:
+                kept.append(line)
+        return kept
+
+
+def follow(path, cursor, log_filter, interval=0.5, duration=300, keepalive=15):
+    # Server-sent events with the lines appended to the log after cursor. The event id is the cursor, so a
+    # reconnecting EventSource resumes where it stopped (Last-Event-ID). The stream ends after duration seconds,
+    # which frees the worker thread, and the browser reconnects on its own.
+    deadline = time.monotonic() + duration
+    last_event = time.monotonic()
+    yield "retry: 1000\n\n"
+    while time.monotonic() < deadline:
+        try:
+            lines, next_cursor = read_lines(path, cursor)
+        except FileNotFoundError:
+            # Caught between the rename and the reopen of a rotation
+            lines, next_cursor = [], cursor
+        if next_cursor != cursor:
+            cursor = next_cursor
+            data = ''.join(f"data: {line}\n" for line in log_filter.apply(lines))
+            yield f"id: {cursor}\n{data}\n"
+            last_event = time.monotonic()
+        elif time.monotonic() - last_event >= keepalive:
+            yield ": keepalive\n\n"
+            last_event = time.monotonic()
+        time.sleep(interval)
@@ -0,0 +1,73 @@
+# matching.py
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+
+# Looks up the color / size names embedded in a SKU suffix such as "dark-blue-xl".
+# A key of the mapping matches when it equals a run of consecutive '-'-separated tokens of the suffix
+# (the startswith(key + '-') / endswith('-' + key) / '-' + key + '-' in / == checks), so instead of
+# testing every key against every SKU we look up every token n-gram of the suffix in a hash of the keys.
+# The longest matching key wins, ties go to the key that comes first in the mapping.
+class SubstringMatcher:
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.rank = {key: i for i, key in enumerate(mapping)}
+        self.max_tokens = max((key.count('-') + 1 for key in mapping), default=0)
+
+    def match(self, part):
+        tokens = part.split('-')
+        best = None
+        for i in range(len(tokens)):
+            for j in range(i + 1, min(len(tokens), i + self.max_tokens) + 1):
+                candidate = '-'.join(tokens[i:j])
+                if candidate not in self.rank:
+                    continue
+                if best is None or len(candidate) > len(best) or \
+                        (len(candidate) == len(best) and self.rank[candidate] < self.rank[best]):
+                    best = candidate
+        if best is None:
+            return None
+        return self.mapping[best]
+
+
+# Matchers of a pool worker process, built once per worker by _init_worker instead of being sent with every chunk
+_worker_matchers = None
+
+
+def _init_worker(colors_data, sizes_data):
+    global _worker_matchers
+    _worker_matchers = (SubstringMatcher(colors_data), SubstringMatcher(sizes_data))
+
+
+def _match_parts(parts, matchers=None):
+    color_matcher, size_matcher = matchers or _worker_matchers
+    return [(color_matcher.match(part), size_matcher.match(part)) for part in parts]
+
+
+def match_color_size(skus, colors_data, sizes_data, workers=1, chunk_size=10000):
+    # Returns a DataFrame with the color and size of each SKU, aligned with the skus Series.
+    # Only the part after the first non-alphanumeric character is matched, SKUs without one have no variation.
+    # With workers > 1 the distinct suffixes are matched in chunks by a process pool; chunks are merged back
+    # in submission order so the result is identical to the serial one.
+    sku_parts = skus.astype(str).str.lower().str.extract(r'[^a-zA-Z0-9](.+)', expand=False)
+    unique_parts = list(sku_parts.dropna().unique())
+
+    if workers > 1 and len(unique_parts) > chunk_size:
+        chunks = [unique_parts[i:i + chunk_size] for i in range(0, len(unique_parts), chunk_size)]
+        # forkserver children do not inherit the job, request and log listener threads of this process, or a
+        # lock one of them held at fork time. _init_worker ships the dictionaries to every worker once.
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(colors_data, sizes_data),
+                                 mp_context=multiprocessing.get_context('forkserver')) as executor:
+            matches = [match for chunk_matches in executor.map(_match_parts, chunks) for match in chunk_matches]
+    else:
+        matches = _match_parts(unique_parts, (SubstringMatcher(colors_data), SubstringMatcher(sizes_data)))
+
+    matches = dict(zip(unique_parts, matches))
+    no_match = (None, None)
+    return pd.DataFrame({
+        'color': pd.Series([matches.get(part, no_match)[0] for part in sku_parts], index=skus.index, dtype=object),
+        'size': pd.Series([matches.get(part, no_match)[1] for part in sku_parts], index=skus.index, dtype=object),
+    })
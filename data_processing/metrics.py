@@ -0,0 +1,107 @@
+# metrics.py
+
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+# Upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _rss():
+    return psutil.Process().memory_info().rss
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# In-process counters, gauges and histograms, rendered in the Prometheus text exposition format by render().
+# Metrics are declared once with their help text, then updated with keyword labels from any thread.
+# With several worker processes every process reports its own numbers.
+class Metrics:
+
+    def __init__(self):
+        self._types = {}
+        self._help = {}
+        self._buckets = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self.histogram('stage_duration_seconds', "Time spent in internal stages of reports, imports and matching")
+        self.gauge('stage_rss_delta_bytes', "Change of the process RSS during the last run of each stage")
+        self.gauge('process_resident_memory_bytes', "Resident memory of this process")
+
+    def counter(self, name, help_text):
+        self._types[name], self._help[name] = 'counter', help_text
+
+    def gauge(self, name, help_text):
+        self._types[name], self._help[name] = 'gauge', help_text
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        self._types[name], self._help[name] = 'histogram', help_text
+        self._buckets[name] = tuple(buckets)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._buckets[name]
+        with self._lock:
+            counts, total, observations = self._values.get(key, ((0,) * len(buckets), 0, 0))
+            counts = tuple(count + (value <= bound) for count, bound in zip(counts, buckets))
+            self._values[key] = (counts, total + value, observations + 1)
+
+    def record_stage(self, stage, seconds, rss_delta=None, **labels):
+        self.observe('stage_duration_seconds', seconds, stage=stage, **labels)
+        if rss_delta is not None:
+            self.set('stage_rss_delta_bytes', rss_delta, stage=stage, **labels)
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        # Time a block and record how much the process RSS changed meanwhile. RSS is process wide, with
+        # requests running side by side the delta includes their allocations as well.
+        timing = {'start': time.perf_counter()}
+        start_rss = _rss()
+        try:
+            yield timing
+        finally:
+            timing['seconds'] = time.perf_counter() - timing['start']
+            self.record_stage(stage, timing['seconds'], _rss() - start_rss, **labels)
+
+    def render(self):
+        self.set('process_resident_memory_bytes', _rss())
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for name, metric_type in self._types.items():
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (value_name, labels), value in sorted(values.items(), key=lambda item: str(item[0])):
+                if value_name != name:
+                    continue
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+                    continue
+                counts, total, observations = value
+                for bound, count in zip(self._buckets[name], counts):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', _number(float(bound))),))} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {observations}")
+                lines.append(f"{name}_sum{_label_text(labels)} {_number(float(total))}")
+                lines.append(f"{name}_count{_label_text(labels)} {observations}")
+        return '\n'.join(lines) + '\n'
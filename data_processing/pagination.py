@@ -0,0 +1,61 @@
+# pagination.py
+
+import pandas as pd
+
+
+def _sort_key(column):
+    # Text columns can mix strings with the 0 placeholders of missing values, compare them as strings
+    if pd.api.types.is_numeric_dtype(column):
+        return column
+    return column.astype(str)
+
+
+def _contains(column, value):
+    return column.astype(str).str.contains(value, case=False, regex=False)
+
+
+# Serve one page of a DataFrame following the DataTables server-side processing protocol
+# (https://datatables.net/manual/server-side): global and per-column search, multi-column ordering
+# and start/length paging. args is the request's query string.
+def paginate_datatables(df, args):
+    records_total = len(df)
+
+    columns = []
+    while f'columns[{len(columns)}][data]' in args:
+        columns.append(args.get(f'columns[{len(columns)}][data]'))
+
+    search_value = args.get('search[value]', '').strip()
+    if search_value:
+        searchable = [column for i, column in enumerate(columns)
+                      if column in df.columns and args.get(f'columns[{i}][searchable]', 'true') == 'true']
+        mask = pd.Series(False, index=df.index)
+        for column in searchable or df.columns:
+            mask |= _contains(df[column], search_value)
+        df = df[mask]
+
+    for i, column in enumerate(columns):
+        column_search = args.get(f'columns[{i}][search][value]', '').strip()
+        if column_search and column in df.columns:
+            df = df[_contains(df[column], column_search)]
+
+    order_by, ascending = [], []
+    while f'order[{len(order_by)}][column]' in args:
+        i = len(order_by)
+        column_index = int(args.get(f'order[{i}][column]'))
+        if column_index >= len(columns) or columns[column_index] not in df.columns:
+            break
+        order_by.append(columns[column_index])
+        ascending.append(args.get(f'order[{i}][dir]', 'asc') == 'asc')
+    if order_by:
+        df = df.sort_values(by=order_by, ascending=ascending, key=_sort_key, kind='stable')
+
+    start = max(int(args.get('start', 0)), 0)
+    length = int(args.get('length', 100))
+    page = df.iloc[start:] if length < 0 else df.iloc[start:start + length]
+
+    return {
+        'draw': int(args.get('draw', 0)),
+        'recordsTotal': records_total,
+        'recordsFiltered': len(df),
+        'data': page.to_dict(orient='records'),
+    }
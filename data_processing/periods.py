@@ -0,0 +1,69 @@
+# periods.py
+
+import datetime
+
+# Period specs of the period report:
+#   'week'                    weeks starting on Monday, labelled by their Monday
+#   'month'                   calendar months, labelled YYYY-MM
+#   '<N>d'                    N day buckets counted from the start of the report range, labelled by their first day
+#   'YYYY-MM-DD,YYYY-MM-DD,…' custom buckets starting on each of the given dates, the first one also takes
+#                             the days between the start of the range and the first date
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value.strip())
+
+
+def parse_period(period):
+    # ('week', None), ('month', None), ('days', N) or ('custom', [sorted bucket start dates]), ValueError otherwise
+    period = (period or '').strip().lower()
+    if period in ('week', 'month'):
+        return period, None
+    if period.endswith('d') and period[:-1].isdigit() and int(period[:-1]) > 0:
+        return 'days', int(period[:-1])
+    try:
+        boundaries = sorted({_date(value) for value in period.split(',') if value.strip()})
+    except ValueError:
+        raise ValueError(f"unknown period {period!r}, use week, month, <N>d or a list of dates")
+    if not boundaries:
+        raise ValueError("no period given")
+    return 'custom', boundaries
+
+
+def period_labels(period, start_date_sql, end_date_sql):
+    # Labels of every bucket overlapping [start, end] in order, including buckets without sales
+    kind, value = parse_period(period)
+    start, end = _date(start_date_sql), _date(end_date_sql)
+    if kind == 'month':
+        labels, month = [], start.replace(day=1)
+        while month <= end:
+            labels.append(month.strftime('%Y-%m'))
+            month = (month + datetime.timedelta(days=31)).replace(day=1)
+        return labels
+    if kind == 'custom':
+        # The bucket of the start date is there even when every given date is after the end of the range
+        first = ([b for b in value if b <= start][-1:] or value[:1])[0]
+        return [first.isoformat()] + [b.isoformat() for b in value if first < b <= end]
+    if kind == 'week':
+        first, step = start - datetime.timedelta(days=start.weekday()), 7
+    else:
+        first, step = start, value
+    return [(first + datetime.timedelta(days=day)).isoformat() for day in range(0, (end - first).days + 1, step)]
+
+
+def period_sql(period, start_date_sql, column='S.sale_date'):
+    # SQL expression with the bucket label of column (an ISO date) and its parameters, matching period_labels
+    kind, value = parse_period(period)
+    if kind == 'month':
+        return f"substr({column}, 1, 7)", []
+    if kind == 'week':
+        # 'weekday 0' moves forward to the next Sunday (or stays on one), six days back is that week's Monday
+        return f"date({column}, 'weekday 0', '-6 days')", []
+    if kind == 'days':
+        return (f"date(?, '+' || (CAST(julianday({column}) - julianday(?) AS INTEGER) / {value} * {value}) "
+                f"|| ' days')", [start_date_sql, start_date_sql])
+    # Custom buckets, latest start date first. Sales before the second date belong to the first bucket.
+    later_starts = [b.isoformat() for b in reversed(value[1:])]
+    cases = ''.join(f"WHEN {column} >= ? THEN ? " for _ in later_starts)
+    params = [b for b in later_starts for _ in range(2)] + [value[0].isoformat()]
+    return (f"CASE {cases}ELSE ? END" if cases else "?"), params
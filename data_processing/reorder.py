@@ -0,0 +1,24 @@
+# reorder.py
+
+import numpy as np
+import pandas as pd
+
+
+def _numbers(values):
+    # Report columns come from SQLite as they were uploaded, so they can hold text such as '1,234'. It counts as 0.
+    return pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+# Suggested order quantity of every report row in one vectorized pass: enough stock to cover cover_days at the
+# sales velocity of the report range (days long), minus the bin inventory, rounded up to whole packs.
+# Returns are not counted as negative demand, negative inventory (back orders) adds to what is needed.
+# pack_size is a number or an array with one pack size per row.
+def suggest_order_quantities(sold_quantity, inventory, days, cover_days, pack_size=1):
+    sold_quantity = _numbers(sold_quantity)
+    inventory = _numbers(inventory)
+    pack_size = np.maximum(np.asarray(pack_size, dtype=float), 1)
+
+    demand = np.clip(sold_quantity, 0, None) * cover_days / max(days, 1)
+    # Rounding first keeps floating point noise such as 10.000000000000002 from ordering an extra pack
+    missing = np.clip(np.round(demand - inventory, 6), 0, None)
+    return (np.ceil(np.round(missing / pack_size, 6)) * pack_size).astype(np.int64)
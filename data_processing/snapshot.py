@@ -0,0 +1,159 @@
+# snapshot.py
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+LOGGER = logging.getLogger('mainApp.snapshot')
+
+CURRENT_FILE = 'CURRENT.json'
+
+
+def _arrow_type(storage_classes):
+    # SQLite storage classes found in a column -> Arrow type. Columns mixing integers and reals are stored as
+    # float64, aggregate() turns them back into integers when the values it returns are all whole numbers.
+    storage_classes = set(storage_classes) - {'null'}
+    if storage_classes <= {'text'}:
+        return pa.string()
+    if storage_classes == {'integer'}:
+        return pa.int64()
+    if storage_classes <= {'integer', 'real'}:
+        return pa.float64()
+    raise ValueError(f"cannot store values of types {', '.join(sorted(storage_classes))} in one snapshot column")
+
+
+def _is_mixed_number(storage_classes):
+    return set(storage_classes) - {'null'} == {'integer', 'real'}
+
+
+def _restore_integers(values):
+    # Integers and whole reals share an INTEGER column in SQLite as integers, read_sql_query only returns floats
+    # when one of the values is fractional
+    if all(value is None or float(value).is_integer() for value in values):
+        return [None if value is None else int(value) for value in values]
+    return values
+
+
+# Columnar copy of the joined sales fact table, stored as uncompressed Arrow IPC files partitioned by month
+# (<directory>/<build>/month=YYYY-MM/part-0.arrow). Files are memory-mapped when scanned, so repeated reports
+# only touch the columns and months they need and several workers share the pages through the OS page cache.
+# A new build is written next to the current one and published by replacing CURRENT.json, which also records
+# the Timestamps it was built from so readers can tell when it is stale.
+class ReportSnapshot:
+
+    available = pa is not None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._build_lock = threading.Lock()
+
+    def _read_current(self):
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_current(self, version):
+        current = self._read_current()
+        return current is not None and current['version'] == version
+
+    def invalidate(self):
+        try:
+            os.remove(os.path.join(self.directory, CURRENT_FILE))
+        except FileNotFoundError:
+            pass
+
+    def build(self, partitions, columns, version):
+        # partitions yields (month, rows) pairs, columns is a list of (name, SQLite storage classes in the column)
+        with self._build_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            build_name = f"build-{time.time_ns()}"
+            build_dir = os.path.join(self.directory, build_name)
+            schema = pa.schema([(name, _arrow_type(storage_classes)) for name, storage_classes in columns])
+            rows_written = 0
+            try:
+                for month, rows in partitions:
+                    arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                    partition_dir = os.path.join(build_dir, f"month={month}")
+                    os.makedirs(partition_dir)
+                    with pa.OSFile(os.path.join(partition_dir, 'part-0.arrow'), 'wb') as sink:
+                        with pa.ipc.new_file(sink, schema) as writer:
+                            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                    rows_written += len(rows)
+            except Exception:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
+
+            current_path = os.path.join(self.directory, CURRENT_FILE)
+            mixed_columns = [name for name, storage_classes in columns if _is_mixed_number(storage_classes)]
+            with open(current_path + '.tmp', 'w') as f:
+                json.dump({'build': build_name if rows_written else None, 'version': version,
+                           'mixed_columns': mixed_columns}, f)
+            os.replace(current_path + '.tmp', current_path)
+
+            # Readers that still have an old build mapped keep their view, unlinking does not affect them
+            for name in os.listdir(self.directory):
+                if name.startswith('build-') and name != build_name:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            return rows_written
+
+    def aggregate(self, version, start_date, end_date, importer, keys, aggregations):
+        # Filter on sale_date (and importer unless it is 'All') and group by keys. aggregations is a list of
+        # (output column, source column, function) with function one of 'sum', 'min' or 'has_null'.
+        # Returns None unless the current build was made from version, otherwise a DataFrame typed the way
+        # read_sql_query types it.
+        current = self._read_current()
+        if current is None or current['version'] != version:
+            return None
+        output_columns = keys + [output_column for output_column, _, _ in aggregations]
+        if current['build'] is None:
+            return pd.DataFrame(columns=output_columns)
+
+        dataset = ds.dataset(os.path.join(self.directory, current['build']), format='ipc', partitioning='hive',
+                             filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+        # The month filter prunes whole partitions before any file is opened
+        condition = ((ds.field('month') >= start_date[:7]) & (ds.field('month') <= end_date[:7]) &
+                     (ds.field('sale_date') >= start_date) & (ds.field('sale_date') <= end_date))
+        if importer != "All":
+            condition &= ds.field('importer') == importer
+        source_columns = list(dict.fromkeys(keys + [column for _, column, _ in aggregations]))
+        table = dataset.to_table(columns=source_columns, filter=condition)
+
+        arrow_aggregations = []
+        for _, column, function in aggregations:
+            if function == 'has_null':
+                arrow_aggregations.append((column, 'count', pc.CountOptions(mode='only_null')))
+            else:
+                arrow_aggregations.append((column, function))
+        grouped = table.group_by(keys, use_threads=False).aggregate(arrow_aggregations)
+
+        mixed_columns = set(current.get('mixed_columns', []))
+        data = {key: grouped[key].to_pylist() for key in keys}
+        for key in keys:
+            if key in mixed_columns:
+                data[key] = _restore_integers(data[key])
+        for output_column, column, function in aggregations:
+            arrow_function = 'count' if function == 'has_null' else function
+            values = grouped[f"{column}_{arrow_function}"].to_pylist()
+            if function == 'has_null':
+                values = [int(value > 0) for value in values]
+            elif column in mixed_columns:
+                values = _restore_integers(values)
+            data[output_column] = values
+        return pd.DataFrame.from_records(list(zip(*[data[column] for column in output_columns])),
+                                         columns=output_columns, coerce_float=True)
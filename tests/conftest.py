@@ -0,0 +1,24 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# app.py opens and upgrades DATABASE when it is imported, keep that out of the working directory
+_workdir = tempfile.mkdtemp(prefix='sales_management_tests_')
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ.setdefault('DATABASE', os.path.join(_workdir, 'sales_management.db'))
+os.environ.setdefault('JOBS_DATABASE', os.path.join(_workdir, 'jobs.db'))
+os.environ.setdefault('REPORT_SNAPSHOT_DIR', os.path.join(_workdir, 'report_snapshot'))
+
+
+@pytest.fixture
+def app_module(tmp_path):
+    # app.py with an empty database of its own for the test
+    import app
+    app.configure_database(database=str(tmp_path / 'sales_management.db'))
+    app.upgrade_database()
+    app.report_cache.clear()
+    yield app
+    app.configure_database(database=os.environ['DATABASE'])
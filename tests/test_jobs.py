@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from data_processing.jobs import JobRunner, _process_owner
+
+
+def insert_job(database, status, owner):
+    conn = sqlite3.connect(database)
+    job_id = conn.execute("INSERT INTO Jobs (kind, table_name, status, owner) VALUES ('import', 'Sales', ?, ?)",
+                          (status, owner)).lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def wait_for(runner, job_id, statuses, timeout=10):
+    deadline = time.time() + timeout
+    while runner.get(job_id)['status'] not in statuses:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    return runner.get(job_id)
+
+
+def test_restart_fails_only_jobs_of_stopped_processes(tmp_path):
+    database = str(tmp_path / 'jobs.db')
+    JobRunner(database)
+    stopped = subprocess.Popen([sys.executable, '-c', 'pass'])
+    stopped_owner = _process_owner(stopped.pid)
+    stopped.wait()
+    jobs = {
+        'stopped': insert_job(database, 'running', stopped_owner),
+        'legacy': insert_job(database, 'queued', None),
+        'alive': insert_job(database, 'running', _process_owner(os.getppid())),
+        'done': insert_job(database, 'done', stopped_owner),
+    }
+
+    runner = JobRunner(database)
+
+    assert {name: runner.get(job_id)['status'] for name, job_id in jobs.items()} == {
+        'stopped': 'failed', 'legacy': 'failed', 'alive': 'running', 'done': 'done'}
+
+
+def test_jobs_wait_for_a_table_held_by_another_process(tmp_path, monkeypatch):
+    database = str(tmp_path / 'jobs.db')
+    runner = JobRunner(database)
+    monkeypatch.setattr(runner, 'LOCK_POLL_SECONDS', 0.05)
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO TableLocks VALUES ('Sales', ?, 0)", (_process_owner(os.getppid()),))
+    conn.commit()
+
+    sales_job = runner.submit('import', 'Sales', lambda progress: 'sales')
+    other_job = runner.submit('import', 'Inventory', lambda progress: 'inventory')
+    assert wait_for(runner, other_job, ['done'])['message'] == 'inventory'
+    time.sleep(0.3)
+    assert runner.get(sales_job)['status'] == 'queued'
+
+    conn.execute("DELETE FROM TableLocks")
+    conn.commit()
+    conn.close()
+    assert wait_for(runner, sales_job, ['done'])['message'] == 'sales'
+    assert sqlite3.connect(database).execute("SELECT COUNT(*) FROM TableLocks").fetchone() == (0,)
+
+
+def test_teardown_runs_in_the_job_thread(tmp_path):
+    torn_down = []
+    runner = JobRunner(str(tmp_path / 'jobs.db'), teardown=lambda: torn_down.append(threading.get_ident()))
+    job_thread = []
+    job_id = runner.submit('matching', 'Variations', lambda progress: job_thread.append(threading.get_ident()))
+    wait_for(runner, job_id, ['done'])
+    deadline = time.time() + 10
+    while not torn_down:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert torn_down == job_thread
@@ -0,0 +1,111 @@
+import random
+import re
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import COLORS, SIZES, _variation_skus
+from data_processing.matching import SubstringMatcher, match_color_size
+
+
+# The matcher run_matching_script used before SubstringMatcher, kept as the reference
+def reference_match_item(d, part):
+    matches = [substring for substring in d if (
+                part.startswith(substring + '-') or
+                part.endswith('-' + substring) or
+                ('-' + substring + '-') in part or
+                substring == part
+               )]
+    if matches:
+        # Sort by length and return the longest match
+        return d[sorted(matches, key=len, reverse=True)[0]]
+    return None
+
+
+def reference_match_color_size(sku, parent_sku, colors_data, sizes_data):
+    if parent_sku == sku:
+        return None, None
+    match_part = re.search(r'[^a-zA-Z0-9](.+)', sku)
+    if not match_part:
+        return None, None
+    sku_part = match_part.group(1)
+    return reference_match_item(colors_data, sku_part), reference_match_item(sizes_data, sku_part)
+
+
+def reference_matches(skus, colors_data, sizes_data):
+    variations = pd.DataFrame({'sku': skus})
+    variations['parent_sku'] = variations['sku'].apply(lambda x: re.match('^[a-zA-Z0-9]*', str(x)).group())
+    variations[['color', 'size']] = variations.dropna(subset=['sku']).apply(
+        lambda row: pd.Series(reference_match_color_size(row['sku'].lower(), row['parent_sku'], colors_data,
+                                                         sizes_data)), axis=1)
+    return variations[['color', 'size']]
+
+
+def substring_mapping(rows, extra=()):
+    # Same shape as read_substring_mapping: lower case Slug and value keys, in descending key order
+    mapping = {}
+    for name, slug, value in list(rows) + list(extra):
+        mapping[slug.lower()] = name.lower()
+        mapping[value.lower()] = name.lower()
+    return dict(sorted(mapping.items(), reverse=True))
+
+
+COLORS_DATA = substring_mapping(COLORS, extra=[
+    ("כחול כהה מאוד", "very-dark-blue", "dark"),  # hyphenated key that contains other keys
+    ("ללא צבע", "", "none"),                       # empty Slug
+    ("אדום בהיר", "rdd", "lred"),                  # same length as red, blu, ... for ties
+])
+SIZES_DATA = substring_mapping(SIZES, extra=[
+    ("ללא מידה", "", "one-size"),
+    ("קטן מאוד", "xs", "x-small"),
+])
+
+
+def real_shaped_skus():
+    rng = random.Random(7)
+    skus = [sku for i in range(300) for sku in _variation_skus(rng, f"{rng.choice('ABCDEFGH')}{i:06d}")]
+    return skus + [
+        'A000001-Dark-Blue-XL', 'A000002/red-small', 'A000003_navy_38', 'A000004-very-dark-blue-x-small',
+        'A000005-red-blk', 'A000006-blk-red', 'A000007-rdd-red-s', 'A000008--red', 'A000009-red-',
+        'A000010-', 'A000011', 'A000012-xl-red-small', 'A000013-dark', 'A000014-blue-dark', 'A000015-one-size',
+        'A000016-s-m-l', 'A000017-redx-xll', 'A000018-light-green-2x-large', 'A000019 red', '-red-xl', None,
+    ]
+
+
+def assert_same_matches(result, expected):
+    assert list(result.index) == list(expected.index)
+    for column in ['color', 'size']:
+        got = [None if pd.isna(value) else value for value in result[column]]
+        want = [None if pd.isna(value) else value for value in expected[column]]
+        assert got == want
+
+
+def test_substring_matcher_matches_reference():
+    parts = ['red', 'dark-blue-xl', 'very-dark-blue-x-small', 'red-blk', 'blk-red', 'rdd-red', '-red', 'red-',
+             '', '-', '--', 'x-small-xs', 'one-size', 'redx', 'xl-red-small', 'dark', 'blue-dark']
+    for mapping in [COLORS_DATA, SIZES_DATA]:
+        matcher = SubstringMatcher(mapping)
+        for part in parts:
+            assert matcher.match(part) == reference_match_item(mapping, part), part
+
+
+def test_empty_mapping():
+    assert SubstringMatcher({}).match('red-xl') is None
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_match_color_size_matches_reference(workers):
+    skus = pd.Series(real_shaped_skus())
+    expected = reference_matches(skus, COLORS_DATA, SIZES_DATA)
+    result = match_color_size(skus, COLORS_DATA, SIZES_DATA, workers=workers, chunk_size=50)
+    assert_same_matches(result, expected)
+    # The sample has to exercise the matcher, not only SKUs without variations
+    assert result['color'].notna().sum() > 100 and result['size'].notna().sum() > 100
+
+
+def test_match_color_size_keeps_index():
+    skus = pd.Series(['A1-red-xl', 'A2', 'A3-blue'], index=[10, 5, 7])
+    result = match_color_size(skus, COLORS_DATA, SIZES_DATA)
+    assert list(result.index) == [10, 5, 7]
+    assert list(result['color']) == ['אדום', None, 'כחול']
+    assert list(result['size']) == ['גדול מאוד', None, None]
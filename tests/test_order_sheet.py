@@ -0,0 +1,66 @@
+import csv
+import io
+
+from benchmarks.synthetic_data import generate
+
+
+def order_sheet(client, form):
+    response = client.post('/show_report', data=form)
+    assert response.status_code == 200
+    return {row['manufacturer_sku']: int(row['Quantity to Order'])
+            for row in csv.DictReader(io.StringIO(response.get_data(as_text=True)))}
+
+
+def test_suggestions_can_be_declined(app_module, tmp_path):
+    app = app_module
+    paths = generate(str(tmp_path / 'data'), 2000)
+    for table_name in ['Colors', 'Sizes', 'Products', 'Inventory', 'BarcodesForVariations', 'Sales']:
+        with open(paths[table_name], 'rb') as file_stream:
+            app.import_table(table_name, file_stream)
+    app.run_matching_script(full_rebuild=True)
+
+    client = app.app.test_client()
+    client.post('/report', data={'start_date': '2023-01-01', 'end_date': '2023-03-31', 'importer': 'All',
+                                 'cover_days': 60, 'pack_size': 1})
+    report = app.generate_report_data('2023-01-01', '2023-03-31', 'All')
+    report = report.assign(**{'suggested order': app.suggest_order_quantities(
+        report['sold quantity'], report['Inventory'], days=90, cover_days=60, pack_size=1)})
+    suggested = report[report['suggested order'] > 0]
+    assert len(suggested) >= 3
+    declined, changed, kept = suggested['manufacturer_sku'].iloc[:3]
+
+    sheet = order_sheet(client, {'use_suggestions': '1', f'quantity_to_order_{declined}': '0',
+                                 f'quantity_to_order_{changed}': '7'})
+
+    assert declined not in sheet
+    assert sheet[changed] == 7
+    assert sheet[kept] == suggested['suggested order'].iloc[2]
+    assert all(quantity > 0 for quantity in sheet.values())
+    assert len(sheet) == len(suggested) - 1
+
+
+def test_suggestions_with_text_inventory(app_module, tmp_path):
+    # An Inventory quantity written with a thousands separator is stored as text and counts as no stock
+    app = app_module
+    paths = generate(str(tmp_path / 'data'), 2000)
+    with open(paths['Inventory'], encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    text_sku = rows[2][0]
+    rows[2][3] = '1,234'
+    with open(paths['Inventory'], 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+    for table_name in ['Colors', 'Sizes', 'Products', 'Inventory', 'BarcodesForVariations', 'Sales']:
+        with open(paths[table_name], 'rb') as file_stream:
+            app.import_table(table_name, file_stream)
+    app.run_matching_script(full_rebuild=True)
+    assert app.get_connection().execute("SELECT typeof(quantity) FROM Inventory WHERE sku = ?",
+                                        (text_sku,)).fetchone() == ('text',)
+
+    client = app.app.test_client()
+    client.post('/report', data={'start_date': '2023-01-01', 'end_date': '2023-03-31', 'importer': 'All',
+                                 'cover_days': 60, 'pack_size': 1})
+    response = client.get('/report_data', query_string={'draw': 1, 'start': 0, 'length': -1})
+    assert response.status_code == 200
+    row = next(row for row in response.get_json()['data'] if row['Inventory'] == '1,234')
+    assert row['suggested order'] == app.suggest_order_quantities([row['sold quantity']], [0], days=90,
+                                                                  cover_days=60)[0]
@@ -0,0 +1,41 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from data_processing.periods import period_labels, period_sql
+
+
+def labels_by_sql(period, start_date, end_date):
+    # The bucket label period_sql gives every day of the range, in order of first appearance
+    conn = sqlite3.connect(':memory:')
+    start, end = datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+    days = [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    expression, params = period_sql(period, start_date, column='day')
+    conn.execute("CREATE TABLE Days (day TEXT)")
+    conn.executemany("INSERT INTO Days VALUES (?)", [(day,) for day in days])
+    labels = [row[0] for row in conn.execute(f"SELECT {expression} FROM Days ORDER BY day", params)]
+    return list(dict.fromkeys(labels))
+
+
+@pytest.mark.parametrize('period', [
+    'week', 'month', '1d', '7d', '10d', '45d',
+    '2022-01-10',
+    '2022-01-10,2022-02-01,2022-03-15',
+    '2021-12-01,2022-01-20',             # every date before the range
+    '2022-01-25,2022-02-01',             # every date after the range
+    '2021-12-01,2022-03-31',             # one date on each side
+    '2022-01-05,2022-01-20',             # dates on the range ends
+])
+@pytest.mark.parametrize('start_date, end_date', [
+    ('2022-01-05', '2022-01-20'),
+    ('2022-01-03', '2022-03-31'),
+    ('2021-12-28', '2022-02-01'),
+    ('2022-02-14', '2022-02-14'),
+])
+def test_labels_match_sql(period, start_date, end_date):
+    assert period_labels(period, start_date, end_date) == labels_by_sql(period, start_date, end_date)
+
+
+def test_first_bucket_after_the_range():
+    assert period_labels('2022-01-25,2022-02-01', '2022-01-05', '2022-01-20') == ['2022-01-25']
@@ -0,0 +1,62 @@
+import csv
+
+import pytest
+
+from benchmarks.synthetic_data import generate
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def snapshot_app(app_module, tmp_path, monkeypatch):
+    from data_processing.snapshot import ReportSnapshot
+    app = app_module
+    monkeypatch.setitem(app.app.config, 'REPORT_SNAPSHOT', True)
+    monkeypatch.setattr(app, 'report_snapshot', ReportSnapshot(str(tmp_path / 'report_snapshot')))
+    return app
+
+
+def load(app, paths, sales_quantities=None):
+    # sales_quantities replaces the quantity of Sales lines, by line number
+    if sales_quantities:
+        with open(paths['Sales'], encoding='utf-8', newline='') as f:
+            rows = list(csv.reader(f))
+        for line, quantity in sales_quantities.items():
+            rows[line + 2][7] = quantity
+        with open(paths['Sales'], 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows(rows)
+    for table_name in ['Colors', 'Sizes', 'Products', 'Inventory', 'BarcodesForVariations', 'Sales']:
+        with open(paths[table_name], 'rb') as file_stream:
+            app.import_table(table_name, file_stream)
+    app.run_matching_script(full_rebuild=True)
+
+
+def assert_snapshot_reports_match(app):
+    for use_rollup in [True, False]:
+        app.app.config['USE_SALES_ROLLUP'] = use_rollup
+        sales_table = 'SalesDaily' if use_rollup else 'Sales'
+        app.refresh_report_snapshot()
+        for start_date, end_date in [('2022-01-01', '2023-12-31'), ('2023-02-01', '2023-02-28')]:
+            for importer in ['All', 'יבואן ב']:
+                from_snapshot = app.build_report_from_snapshot(sales_table, start_date, end_date, importer)
+                assert from_snapshot is not None
+                from_sql = app.build_report(app.get_connection(), sales_table, start_date, end_date, importer)
+                assert from_snapshot.reset_index(drop=True).equals(from_sql.reset_index(drop=True))
+
+
+def test_fractional_quantities_after_the_first_chunk(snapshot_app, tmp_path, monkeypatch):
+    # The first chunk types Sales.quantity as INTEGER, the fractional quantities of later chunks are stored as reals
+    app = snapshot_app
+    monkeypatch.setitem(app.app.config, 'IMPORT_CHUNK_ROWS', 100)
+    monkeypatch.setitem(app.app.config, 'USE_SALES_ROLLUP', True)
+    load(app, generate(str(tmp_path / 'data'), 1000), {500: '1.5', 900: '0.25'})
+    assert {row[0] for row in app.get_connection().execute("SELECT DISTINCT typeof(quantity) FROM Sales")} == {
+        'integer', 'real'}
+    assert_snapshot_reports_match(app)
+
+
+def test_integer_quantities(snapshot_app, tmp_path, monkeypatch):
+    app = snapshot_app
+    monkeypatch.setitem(app.app.config, 'USE_SALES_ROLLUP', True)
+    load(app, generate(str(tmp_path / 'data'), 1000))
+    assert_snapshot_reports_match(app)
@@ -0,0 +1,161 @@
+import csv
+import io
+
+import pytest
+
+from benchmarks.synthetic_data import INVENTORY_HEADER, SALES_HEADER
+
+
+def sales_csv(lines):
+    # lines are (document_type, document_number, sku, quantity, 'DD/MM/YYYY')
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["דוח"])
+    writer.writerow(SALES_HEADER)
+    for document_type, document_number, sku, quantity, issue_date in lines:
+        writer.writerow([sku, f"פריט {sku}", document_type, document_number, 1, "החברה שלי", 10, quantity,
+                         10 * quantity, f"{issue_date} 10:00"])
+    return io.BytesIO(buf.getvalue().encode('utf-8'))
+
+
+def inventory_csv(lines):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["דוח"])
+    writer.writerow(INVENTORY_HEADER)
+    for sku, quantity in lines:
+        writer.writerow([sku, f"M-{sku}", f"פריט {sku}", quantity])
+    return io.BytesIO(buf.getvalue().encode('utf-8'))
+
+
+def sales_rows(app):
+    return sorted(app.get_connection().execute(
+        "SELECT document_type, document_number, sku, quantity, sale_date FROM Sales").fetchall())
+
+
+def load_counters(app, table_name):
+    return app.get_connection().execute("SELECT rows_inserted, rows_updated FROM Timestamps WHERE table_name = ?",
+                                        (table_name,)).fetchone()
+
+
+def assert_sales_daily_rebuilt(app):
+    # The partially refreshed rollup has to equal a rollup built from scratch
+    conn = app.get_connection()
+    rollup = sorted(conn.execute("SELECT sku, sale_date, quantity FROM SalesDaily").fetchall())
+    rebuilt = sorted(conn.execute(f"{app.sales_rollup_select('Sales')} GROUP BY sku, sale_date").fetchall())
+    assert rollup == rebuilt
+
+
+INITIAL_SALES = [
+    ('invoice', '100', 'A1-red', 1, '01/03/2023'),
+    ('invoice', '100', 'A2-blue', 2, '01/03/2023'),
+    ('invoice', '101', 'A1-red', 3, '02/03/2023'),
+    ('delivery', '007', 'B1', 4, '05/03/2023'),
+]
+
+
+def test_new_changed_and_unchanged_keys(app_module):
+    app = app_module
+    app.import_table('Sales', sales_csv(INITIAL_SALES))
+
+    result = app.import_table('Sales', sales_csv([
+        ('invoice', '100', 'A1-red', 1, '01/03/2023'),    # unchanged
+        ('invoice', '101', 'A1-red', 5, '02/03/2023'),    # quantity changed
+        ('delivery', '007', 'B1', 4, '06/03/2023'),       # date changed
+        ('invoice', '102', 'A2-blue', 7, '10/03/2023'),   # new
+    ]), upsert=True)
+
+    assert result == '1 rows inserted, 2 rows updated'
+    assert load_counters(app, 'Sales') == (1, 2)
+    assert sales_rows(app) == sorted([
+        ('invoice', '100', 'A1-red', 1, '2023-03-01'),
+        ('invoice', '100', 'A2-blue', 2, '2023-03-01'),   # not in the upload, kept
+        ('invoice', '101', 'A1-red', 5, '2023-03-02'),
+        ('delivery', '007', 'B1', 4, '2023-03-06'),
+        ('invoice', '102', 'A2-blue', 7, '2023-03-10'),
+    ])
+    assert_sales_daily_rebuilt(app)
+
+    # Uploading the same file again writes nothing
+    assert app.import_table('Sales', sales_csv([
+        ('invoice', '100', 'A1-red', 1, '01/03/2023'),
+        ('invoice', '102', 'A2-blue', 7, '10/03/2023'),
+    ]), upsert=True) == '0 rows inserted, 0 rows updated'
+
+
+def test_duplicate_lines_under_one_key(app_module):
+    app = app_module
+    app.import_table('Sales', sales_csv(INITIAL_SALES))
+    line = ('invoice', '100', 'A1-red', 1, '01/03/2023')
+
+    # A document with the same line twice replaces the single line of that key
+    assert app.import_table('Sales', sales_csv([line, line]), upsert=True) == '0 rows inserted, 2 rows updated'
+    assert sales_rows(app).count(('invoice', '100', 'A1-red', 1, '2023-03-01')) == 2
+    assert app.import_table('Sales', sales_csv([line, line]), upsert=True) == '0 rows inserted, 0 rows updated'
+
+    # Back to a single line, and to a different line next to the first one
+    assert app.import_table('Sales', sales_csv([line]), upsert=True) == '0 rows inserted, 1 rows updated'
+    assert sales_rows(app).count(('invoice', '100', 'A1-red', 1, '2023-03-01')) == 1
+    other = ('invoice', '100', 'A1-red', 2, '03/03/2023')
+    assert app.import_table('Sales', sales_csv([line, other]), upsert=True) == '0 rows inserted, 2 rows updated'
+    assert app.import_table('Sales', sales_csv([line]), upsert=True) == '0 rows inserted, 1 rows updated'
+    assert [row for row in sales_rows(app) if row[:3] == ('invoice', '100', 'A1-red')] == [
+        ('invoice', '100', 'A1-red', 1, '2023-03-01')]
+
+    # New keys with repeated lines are inserted with all of them
+    new_line = ('invoice', '200', 'B1', 1, '04/03/2023')
+    assert app.import_table('Sales', sales_csv([new_line] * 3), upsert=True) == '3 rows inserted, 0 rows updated'
+    assert len(sales_rows(app)) == len(INITIAL_SALES) + 3
+    assert_sales_daily_rebuilt(app)
+
+
+def test_upsert_into_missing_table(app_module):
+    app = app_module
+    assert app.import_table('Sales', sales_csv(INITIAL_SALES), upsert=True) == '4 rows inserted, 0 rows updated'
+    assert sales_rows(app) == sorted([row[:4] + ('2023-03-0' + row[4][1],) for row in INITIAL_SALES])
+    assert_sales_daily_rebuilt(app)
+
+    assert app.import_table('Inventory', inventory_csv([('A1-red', 5), ('B1', 0)]),
+                            upsert=True) == '2 rows inserted, 0 rows updated'
+    assert load_counters(app, 'Inventory') == (2, 0)
+
+
+def test_inventory_snapshot_by_sku(app_module):
+    app = app_module
+    app.import_table('Inventory', inventory_csv([('A1-red', 5), ('A2-blue', 3), ('B1', 0)]))
+
+    result = app.import_table('Inventory', inventory_csv([('A2-blue', 3), ('B1', 9), ('C1', 1)]), upsert=True)
+
+    assert result == '1 rows inserted, 1 rows updated'
+    assert sorted(app.get_connection().execute("SELECT sku, quantity FROM Inventory").fetchall()) == [
+        ('A1-red', 5), ('A2-blue', 3), ('B1', 9), ('C1', 1)]
+
+
+def test_sales_daily_after_upserts(app_module):
+    app = app_module
+    app.import_table('Sales', sales_csv(INITIAL_SALES))
+    # Moves a line to another day, replaces a day's only line and adds lines to existing and new days
+    app.import_table('Sales', sales_csv([
+        ('invoice', '100', 'A1-red', 1, '04/03/2023'),
+        ('delivery', '007', 'B1', 1, '05/03/2023'),
+        ('invoice', '103', 'A1-red', 2, '02/03/2023'),
+        ('invoice', '104', 'A1-red', 2, '09/03/2023'),
+    ]), upsert=True)
+    assert_sales_daily_rebuilt(app)
+    assert app.get_connection().execute(
+        "SELECT quantity FROM SalesDaily WHERE sku = 'A1-red' AND sale_date = '2023-03-01'").fetchone() is None
+
+
+def test_failed_rollup_refresh_rolls_back_the_merge(app_module, monkeypatch):
+    app = app_module
+    app.import_table('Sales', sales_csv(INITIAL_SALES))
+    before = sales_rows(app)
+
+    def fail(conn, sale_dates=None):
+        raise RuntimeError("rollup refresh failed")
+    monkeypatch.setattr(app, 'refresh_sales_rollup', fail)
+    with pytest.raises(RuntimeError):
+        app.import_table('Sales', sales_csv([('invoice', '101', 'A1-red', 5, '02/03/2023')]), upsert=True)
+
+    assert sales_rows(app) == before
+    assert_sales_daily_rebuilt(app)